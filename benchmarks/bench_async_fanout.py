@@ -0,0 +1,55 @@
+""" Benchmarks AsyncModelStore against the sequential ModelStore for N independent
+    operations: single reads by guid, and a batch read of every guid in the table,
+    which is split into BatchGetItem chunks of 100.
+
+    moto answers in-process, so --latency-ms adds a per call delay to model the
+    round trip to dynamodb, which is what the concurrent calls overlap.
+"""
+import argparse
+import asyncio
+from common import mock_table, add_latency, timed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--items', type=int, default=1000)
+    parser.add_argument('--latency-ms', type=float, default=20.0)
+    parser.add_argument('--operations', type=int, nargs='+', default=[1, 10, 50, 100])
+    parser.add_argument('--concurrency', type=int, default=16)
+    args = parser.parse_args()
+
+    with mock_table(args.items) as table:
+        from models import ModelStore, AsyncModelStore, aws_session
+        guids = [item['guid'] for item in table.scan()['Items']]
+        # workers make their own clients from the session, so the delay is added to it
+        add_latency(aws_session(), args.latency_ms)
+        store = ModelStore(table.name)
+        async_store = AsyncModelStore(store, max_concurrency=args.concurrency)
+
+        def sync_reads(n):
+            return [store.get_by_guid(guid) for guid in guids[:n]]
+
+        def async_reads(n):
+            async def reads():
+                return await asyncio.gather(*[async_store.get_by_guid(guid) for guid in guids[:n]])
+            return asyncio.run(reads())
+
+        def async_batch(guids):
+            return asyncio.run(async_store.batch_get(guids))
+
+        # the workers make their stores on their first call
+        async_reads(args.concurrency)
+        print(f"concurrency {args.concurrency}, {args.latency_ms}ms a call")
+        print(f"{'operations':>10} {'sync s':>9} {'async s':>9} {'speedup':>8}")
+        for n in args.operations:
+            sync_elapsed, _ = timed(sync_reads, n)
+            async_elapsed, _ = timed(async_reads, n)
+            print(f"{n:>10} {sync_elapsed:>9.3f} {async_elapsed:>9.3f} {sync_elapsed / async_elapsed:>8.1f}")
+        sync_elapsed, _ = timed(store.batch_get, guids)
+        async_elapsed, _ = timed(async_batch, guids)
+        print(f"{'batch_get':>10} {sync_elapsed:>9.3f} {async_elapsed:>9.3f} {sync_elapsed / async_elapsed:>8.1f} ({len(guids)} guids)")
+        async_store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+""" Measures the import cost of the lambda handler modules, which is the part of
+    a cold start this project controls. Each run imports the module in a fresh
+    interpreter with python -X importtime and reports the median cumulative
+    time and the modules that cost the most. Use --budget-ms to fail when the
+    median goes over a budget, so import regressions are caught.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from common import root
+
+
+def import_times(module: str) -> dict:
+    """ Imports module in a fresh interpreter and returns the cumulative import
+        time in microseconds and the nesting depth of every module it loaded.
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+        cwd=f"{root}/src",
+        env={**os.environ, 'PYTHONDONTWRITEBYTECODE': '1'},
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        # import time: <self us> | <cumulative us> | <2 spaces per level><name>
+        _, cumulative_us, raw_name = line.split('|')
+        name = raw_name.strip()
+        depth = (len(raw_name) - len(raw_name.lstrip()) - 1) // 2
+        times[name] = (int(cumulative_us), depth)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--modules', nargs='+', default=['api', 'events'])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=8)
+    parser.add_argument('--budget-ms', type=float, default=None)
+    args = parser.parse_args()
+
+    over_budget = False
+    for module in args.modules:
+        runs = [import_times(module) for _ in range(args.runs)]
+        median_ms = statistics.median(run[module][0] for run in runs) / 1000
+        print(f"{module}: median {median_ms:.1f}ms over {args.runs} runs, slowest direct imports:")
+        last = runs[-1]
+        direct = [name for name, (_, depth) in last.items() if depth == 1]
+        for name in sorted(direct, key=lambda name: last[name][0], reverse=True)[:args.top]:
+            print(f"    {last[name][0] / 1000:>8.1f}ms  {name}")
+        if args.budget_ms is not None and median_ms > args.budget_ms:
+            print(f"{module}: over the budget of {args.budget_ms}ms")
+            over_budget = True
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == '__main__':
+    main()
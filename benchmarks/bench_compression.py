@@ -0,0 +1,42 @@
+""" Benchmarks the size and cpu trade off of compressing listing responses
+    with api.compress_response, for a range of listing sizes and zlib levels.
+    Sizes are of the body as returned to api gateway, so include base64.
+"""
+import argparse
+import time
+import common  # puts src on the path
+import api
+from models import Model, Response
+
+
+def make_body(count: int, metadata_keys: int) -> dict:
+    response = Response()
+    response.add_models([Model(**common.make_item(metadata_keys)) for _ in range(count)])
+    return response.dump()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--models', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--metadata-keys', type=int, default=8)
+    parser.add_argument('--levels', type=int, nargs='+', default=[1, 5, 9])
+    parser.add_argument('--coding', default='gzip', choices=['gzip', 'deflate'])
+    parser.add_argument('--iterations', type=int, default=20)
+    args = parser.parse_args()
+
+    api.compression_min_bytes = 0
+    print(f"{'models':>7} {'level':>5} {'plain bytes':>12} {'sent bytes':>11} {'ratio':>6} {'ms':>8}")
+    for count in args.models:
+        plain = make_body(count, args.metadata_keys)
+        for level in args.levels:
+            api.compression_level = level
+            start = time.process_time()
+            for _ in range(args.iterations):
+                sent = api.compress_response(dict(plain), args.coding)
+            ms = (time.process_time() - start) / args.iterations * 1000
+            ratio = len(sent['body']) / len(plain['body'])
+            print(f"{count:>7} {level:>5} {len(plain['body']):>12} {len(sent['body']):>11} {ratio:>6.2f} {ms:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
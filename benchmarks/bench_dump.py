@@ -0,0 +1,45 @@
+""" Benchmarks Response.dump against the pydantic dict()/json() serialization
+    it replaced, for responses of 1, 100 and 10k models and an error only
+    response. Run it with and without orjson installed to compare encoders.
+"""
+import argparse
+import timeit
+import common  # puts src on the path
+import models
+from models import Model, ModelError, Response
+
+
+def pydantic_dump(response: Response) -> dict:
+    """ The serialization Response.dump used before, for comparison """
+    me = response.dict(exclude={'body'})
+    me['body'] = response.body.json()
+    return me
+
+
+def make_response(count: int) -> Response:
+    response = Response()
+    response.add_models([Model(**common.make_item(metadata_keys=8)) for _ in range(count)])
+    return response
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--models', type=int, nargs='+', default=[1, 100, 10000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    error_only = Response()
+    error_only.add_model_error(ModelError(status=400, title="object not found", detail="not found"))
+    cases = [('errors only', error_only)] + [(f"{count} models", make_response(count)) for count in args.models]
+
+    print(f"encoder: {'orjson' if models.orjson is not None else 'json'}")
+    print(f"{'response':<14} {'pydantic dumps/s':>17} {'dump dumps/s':>13} {'speedup':>8}")
+    for name, response in cases:
+        number = max(1, 20000 // max(1, len(response.body.models)))
+        old = min(timeit.repeat(lambda: pydantic_dump(response), number=number, repeat=args.repeat)) / number
+        new = min(timeit.repeat(lambda: response.dump(), number=number, repeat=args.repeat)) / number
+        print(f"{name:<14} {1 / old:>17.0f} {1 / new:>13.0f} {old / new:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+""" Load test of the lambda handlers in process, to catch throughput and tail
+    latency regressions and to size the memory of the lambdas before a deploy.
+
+    A mix of api gateway v2 events, gets, listings, posts, patches and deletes
+    with metadata of varying size, is replayed through api.router by --concurrency
+    threads against a local backend (see backends.py). Every change the backend
+    makes is turned into a dynamodb stream record, and the records are replayed in
+    batches through events.dynamo_stream_handler, which publishes to a stand in
+    for eventbridge. Reports the p50/p95/p99 latency of each kind of invocation,
+    invocations per second and the peak rss of the process.
+
+    Threads share the GIL, so a concurrency above 1 measures contention between
+    requests in flight rather than more throughput. Use --budget-p99-ms to fail
+    when the p99 of the api invocations goes over a budget.
+"""
+import argparse
+import math
+import random
+import resource
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue, Empty
+from typing import Dict, List, Optional, Tuple
+from common import make_item, lambda_context, api_event
+
+OPERATIONS = ('get', 'list', 'post', 'patch', 'delete')
+HEADERS = {"content-type": "application/json", "accept-encoding": "gzip"}
+
+
+def parse_mix(spec: str) -> Dict[str, int]:
+    """ Parses a mix such as 'get=50,post=20' into the weight of each operation """
+    mix = {}
+    for part in spec.split(','):
+        op, _, weight = part.partition('=')
+        if op not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"{op} is not one of {', '.join(OPERATIONS)}")
+        mix[op] = int(weight)
+    return mix
+
+
+class Workload():
+    """ Generates the events of the load test, keeping the guids of the models
+        that exist so reads, patches and deletes mostly find their model
+    """
+    def __init__(self, guids: List[str], mix: Dict[str, int], metadata_keys: List[int], value_bytes: int, seed: int) -> None:
+        self.guids = list(guids)
+        self.ops = list(mix)
+        self.weights = [mix[op] for op in self.ops]
+        self.metadata_keys = metadata_keys
+        self.value_bytes = value_bytes
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def metadata(self) -> Dict[str, str]:
+        keys = self.random.choice(self.metadata_keys)
+        return {f"key{i}": uuid.uuid4().hex[:self.value_bytes].ljust(self.value_bytes, 'x') for i in range(keys)}
+
+    def next(self) -> Tuple[str, Dict, Optional[str]]:
+        """ Returns the operation, its event and the guid of a model it creates """
+        with self.lock:
+            op = self.random.choices(self.ops, self.weights)[0]
+            if op in ('get', 'patch', 'delete') and not self.guids:
+                op = 'post'
+            if op == 'get':
+                guid = self.random.choice(self.guids)
+                return op, api_event('GET', f"/api/models/{guid}", headers=HEADERS), None
+            if op == 'list':
+                return op, api_event('GET', "/api/models", query={'limit': '25'}, headers=HEADERS), None
+            if op == 'post':
+                guid = str(uuid.uuid4())
+                body = {'guid': guid, 'name': f"load-{guid[:8]}", 'metadata': self.metadata()}
+                return op, api_event('POST', "/api/models", body=body, headers=HEADERS), guid
+            # a deleted guid is dropped before the delete, so no other request picks it
+            i = self.random.randrange(len(self.guids))
+            guid = self.guids[i]
+            if op == 'delete':
+                self.guids[i] = self.guids[-1]
+                self.guids.pop()
+                return op, api_event('DELETE', f"/api/models/{guid}", headers=HEADERS), None
+            body = {'name': f"load-{uuid.uuid4().hex[:8]}", 'metadata': self.metadata()}
+            return op, api_event('PATCH', f"/api/models/{guid}", body=body, headers=HEADERS), None
+
+    def created(self, guid: str) -> None:
+        with self.lock:
+            self.guids.append(guid)
+
+
+class LocalEventBridge():
+    """ Stands in for the boto3 events client, accepting every entry """
+    def __init__(self) -> None:
+        self.entries = 0
+
+    def put_events(self, Entries):
+        self.entries += len(Entries)
+        return {'FailedEntryCount': 0, 'Entries': [{'EventId': str(i)} for i in range(len(Entries))]}
+
+
+class StreamReplay():
+    """ Turns the changes of a local backend into dynamodb stream records and
+        replays them in batches through events.dynamo_stream_handler on a thread
+    """
+    def __init__(self, batch_size: int, context) -> None:
+        from boto3.dynamodb.types import TypeSerializer
+        self.serializer = TypeSerializer()
+        self.batch_size = batch_size
+        self.context = context
+        self.changes = Queue()
+        self.sequence = 0
+        self.latencies: List[float] = []
+        self.records = 0
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="stream-replay")
+
+    def listen(self, name: str, old: Optional[Dict], new: Optional[Dict]) -> None:
+        self.changes.put((name, old, new))
+
+    def _image(self, item: Optional[Dict]) -> Optional[Dict]:
+        if item is None:
+            return None
+        return {k: self.serializer.serialize(v) for k, v in item.items() if v is not None}
+
+    def _record(self, name: str, old: Optional[Dict], new: Optional[Dict]) -> Dict:
+        self.sequence += 1
+        dynamodb = {
+            'Keys': {'guid': {'S': (new or old)['guid']}},
+            'StreamViewType': 'NEW_AND_OLD_IMAGES',
+            'SequenceNumber': str(self.sequence),
+            'SizeBytes': 100,
+        }
+        if new is not None:
+            dynamodb['NewImage'] = self._image(new)
+        if old is not None:
+            dynamodb['OldImage'] = self._image(old)
+        return {
+            'eventID': str(self.sequence),
+            'eventName': name,
+            'eventVersion': '1.1',
+            'eventSource': 'aws:dynamodb',
+            'awsRegion': 'us-east-1',
+            'eventSourceARN': 'arn:aws:dynamodb:us-east-1:123456789012:table/models/stream/2021-01-01T00:00:00.000',
+            'dynamodb': dynamodb,
+        }
+
+    def _run(self) -> None:
+        import events
+        while True:
+            records = []
+            try:
+                while len(records) < self.batch_size:
+                    records.append(self._record(*self.changes.get(timeout=0.05)))
+            except Empty:
+                pass
+            if records:
+                start = time.perf_counter()
+                events.dynamo_stream_handler({'Records': records}, self.context)
+                self.latencies.append(time.perf_counter() - start)
+                self.records += len(records)
+            elif self.done.is_set():
+                return
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        """ Waits for the changes made so far to be replayed """
+        self.done.set()
+        self.thread.join()
+
+
+def percentile(ordered: List[float], q: float) -> float:
+    """ Nearest rank percentile of sorted values """
+    if not ordered:
+        return float('nan')
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+def peak_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+def latency_row(name: str, latencies: List[float], extra: str = "") -> str:
+    ordered = sorted(latencies)
+    p50, p95, p99 = (percentile(ordered, q) * 1000 for q in (50, 95, 99))
+    return f"{name:<10} {len(ordered):>7} {extra} {p50:>8.2f} {p95:>8.2f} {p99:>8.2f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backend', choices=['memory', 'sqlite'], default='memory')
+    parser.add_argument('--sqlite-path', default=':memory:')
+    parser.add_argument('--items', type=int, default=500, help="models in the table before the run")
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=100, help="requests made before measuring")
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix("get=50,list=10,post=15,patch=15,delete=10"))
+    parser.add_argument('--metadata-keys', type=int, nargs='+', default=[0, 4, 16, 64],
+                        help="the metadata of a written model has one of these numbers of keys")
+    parser.add_argument('--value-bytes', type=int, default=32, help="size of each metadata value")
+    parser.add_argument('--cache-size', type=int, default=0, help="size of the model cache of the api, 0 disables it")
+    parser.add_argument('--stream-batch', type=int, default=100, help="records per invocation of the events handler")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--budget-p99-ms', type=float, default=None)
+    args = parser.parse_args()
+
+    rss_before = peak_rss_mb()
+    import api
+    import events
+    import models
+    from models import ModelStore, ModelCache, ModelEventPublisher
+    models.sqlite_path = args.sqlite_path
+    cache = ModelCache(args.cache_size, api.cache_ttl) if args.cache_size > 0 else None
+    api.model_store = ModelStore(api.ddb_table_name, cache=cache, name_index='name-index', backend=args.backend)
+    table = api.model_store.table
+    seeded = [make_item(random.Random(args.seed + i).choice(args.metadata_keys)) for i in range(args.items)]
+    for item in seeded:
+        table.put_item(Item=item)
+    eventbridge = LocalEventBridge()
+    events.publisher = ModelEventPublisher(eventbridge)
+
+    context = lambda_context()
+    workload = Workload([item['guid'] for item in seeded], args.mix, args.metadata_keys, args.value_bytes, args.seed)
+    stream = StreamReplay(args.stream_batch, context)
+    table.subscribe(stream.listen)
+    stream.start()
+
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    statuses: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+
+    def invoke(measure: bool) -> None:
+        op, event, created = workload.next()
+        start = time.perf_counter()
+        response = api.router(event, context)
+        elapsed = time.perf_counter() - start
+        status = response['statusCode']
+        if created is not None and status == 200:
+            workload.created(created)
+        if measure:
+            latencies[op].append(elapsed)
+            statuses[op][status // 100] += 1
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(lambda _: invoke(False), range(args.warmup)))
+        start = time.perf_counter()
+        list(executor.map(lambda _: invoke(True), range(args.requests)))
+        wall = time.perf_counter() - start
+    stream.stop()
+
+    measured = [latency for op in latencies for latency in latencies[op]]
+    print(f"backend {args.backend}, concurrency {args.concurrency}, {args.requests} requests in {wall:.2f}s, "
+          f"{args.requests / wall:.0f} invocations/s")
+    print(f"{'api':<10} {'count':>7} {'2xx/3xx':>7} {'4xx':>5} {'5xx':>5} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for op in OPERATIONS:
+        if latencies[op]:
+            s = statuses[op]
+            print(latency_row(op, latencies[op], f"{s[2] + s[3]:>7} {s[4]:>5} {s[5]:>5}"))
+    total = {k: sum(statuses[op][k] for op in statuses) for k in (2, 3, 4, 5)}
+    print(latency_row('all', measured, f"{total[2] + total[3]:>7} {total[4]:>5} {total[5]:>5}"))
+    print(f"{'stream':<10} {'batches':>7} {'records':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    print(latency_row('events', stream.latencies, f"{stream.records:>7}") + f"  ({eventbridge.entries} events put)")
+    print(f"peak rss {peak_rss_mb():.1f}MB, {rss_before:.1f}MB before the handlers were imported")
+
+    p99_ms = percentile(sorted(measured), 99) * 1000
+    if args.budget_p99_ms is not None and p99_ms > args.budget_p99_ms:
+        print(f"p99 of {p99_ms:.2f}ms is over the budget of {args.budget_p99_ms}ms")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+""" Benchmarks ModelStore.scan_parallel for an increasing number of segments.
+
+    The table is served in process by the memory backend of backends.py by default,
+    so --latency-ms adds a per call delay to model the round trip to dynamodb, which
+    is what the segments overlap. The scans of a local backend share its lock, so
+    past a few segments its cpu rather than the latency is what is measured. moto
+    releases before 4.x ignore Segment and return the whole table to every segment,
+    so --backend dynamodb only measures scaling with a moto that implements it.
+    Fails when a model is read more than once.
+"""
+import argparse
+import sys
+from common import mock_table, local_table, add_latency, timed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--items', type=int, default=2000)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--latency-ms', type=float, default=20.0)
+    parser.add_argument('--segments', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--backend', choices=['dynamodb', 'memory', 'sqlite'], default='memory')
+    args = parser.parse_args()
+
+    tables = mock_table(args.items) if args.backend == 'dynamodb' else local_table(args.backend, args.items)
+    duplicated = False
+    with tables as table:
+        import models
+        from models import ModelStore
+        models.sqlite_path = ':memory:'
+        store = ModelStore(table.name, backend=args.backend)
+        add_latency(store.table.meta.client, args.latency_ms)
+        print(f"{'segments':>8} {'seconds':>9} {'models/s':>10} {'models':>8} {'unique':>8}")
+        for segments in args.segments:
+            elapsed, models = timed(lambda: list(store.scan_parallel(segments, page_size=args.page_size)))
+            unique = len({m.guid for m in models})
+            duplicated = duplicated or unique != len(models)
+            print(f"{segments:>8} {elapsed:>9.3f} {unique / elapsed:>10.0f} {len(models):>8} {unique:>8}")
+    if duplicated:
+        print("models were read more than once, the segments of the scan overlap")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+""" Benchmarks the cpu time api.router spends per request on a warm container,
+    for reading one model by path and by body guid and for a page of models.
+    The table is served by moto by default, whose own cost is included, so compare
+    runs with each other rather than with the latency seen in aws. With --backend
+    memory or sqlite the table is served in process by backends.py instead, which
+    leaves mostly the cost of routing and serialization.
+"""
+import argparse
+from common import mock_table, local_table, lambda_context, api_event, cpu_per_call
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--items', type=int, default=100)
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--backend', choices=['dynamodb', 'memory', 'sqlite'], default='dynamodb')
+    args = parser.parse_args()
+
+    tables = mock_table(args.items) if args.backend == 'dynamodb' else local_table(args.backend, args.items)
+    with tables as table:
+        import api
+        import models
+        models.sqlite_path = ':memory:'
+        api.model_store = models.ModelStore(table.name, backend=args.backend)
+        guid = table.scan(Limit=1)['Items'][0]['guid']
+        context = lambda_context()
+        cases = {
+            'GET one (path)': api_event('GET', f"/api/models/{guid}"),
+            'GET one (body)': api_event('GET', "/api/models", body={'guid': guid}),
+            'GET all (limit 25)': api_event('GET', "/api/models", query={'limit': '25'}),
+            'GET unknown route': api_event('GET', "/api/unknown"),
+        }
+        print(f"{'request':<20} {'cpu us/request':>15}")
+        for name, event in cases.items():
+            us = cpu_per_call(lambda: api.router(event, context), args.iterations)
+            print(f"{name:<20} {us:>15.1f}")
+
+
+if __name__ == '__main__':
+    main()
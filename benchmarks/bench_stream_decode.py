@@ -0,0 +1,47 @@
+""" Benchmarks decoding a dynamodb stream image with the models decoder
+    against the dynamodb_json json_util round trip it replaced, for growing
+    metadata maps of mixed attribute types.
+"""
+import argparse
+import timeit
+import common  # puts src on the path
+from dynamodb_json import json_util
+from models import decode_attribute_value
+
+
+def make_image(keys: int) -> dict:
+    metadata = {}
+    for i in range(keys):
+        kind = i % 4
+        if kind == 0:
+            metadata[f"key{i}"] = {'S': f"value{i}"}
+        elif kind == 1:
+            metadata[f"key{i}"] = {'N': str(i)}
+        elif kind == 2:
+            metadata[f"key{i}"] = {'BOOL': True}
+        else:
+            metadata[f"key{i}"] = {'M': {'inner': {'L': [{'S': 'a'}, {'N': '1.5'}]}}}
+    return {
+        'guid': {'S': '60a5de7e-17ea-411e-b092-0652646f9d3a'},
+        'name': {'S': 'jill'},
+        'metadata': {'M': metadata}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--keys', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'keys':>8} {'json_util us':>14} {'decoder us':>12} {'speedup':>8}")
+    for keys in args.keys:
+        image = make_image(keys)
+        number = max(1, 20000 // keys)
+        old = min(timeit.repeat(lambda: json_util.loads(image), number=number, repeat=args.repeat)) / number
+        new = min(timeit.repeat(lambda: {k: decode_attribute_value(v) for k, v in image.items()}, number=number, repeat=args.repeat)) / number
+        print(f"{keys:>8} {old * 1e6:>14.1f} {new * 1e6:>12.1f} {old / new:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+""" Shared setup for the benchmarks, run them from the root of the project:
+
+    python benchmarks/bench_parallel_scan.py --help
+"""
+import os
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+
+# need to patch path the same way the tests do due to the way lambdas handle imports
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, f"{root}/src")
+
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+os.environ.setdefault('AWS_SECURITY_TOKEN', 'testing')
+os.environ.setdefault('AWS_SESSION_TOKEN', 'testing')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+
+def make_item(metadata_keys: int = 4) -> dict:
+    return {
+        'guid': str(uuid.uuid4()),
+        'name': f"model-{uuid.uuid4().hex[:8]}",
+        'metadata': {f"key{i}": f"value{i}" for i in range(metadata_keys)}
+    }
+
+
+@contextmanager
+def mock_table(items: int = 0, metadata_keys: int = 4, table_name: str = 'models'):
+    """ Creates the models table in moto and fills it with generated items
+
+    Yields:
+        Table: the boto3 table resource
+    """
+    import boto3
+    from moto import mock_dynamodb2
+    with mock_dynamodb2():
+        ddb = boto3.resource('dynamodb', region_name="us-east-1")
+        table = ddb.create_table(
+            TableName=table_name,
+            KeySchema=[{'AttributeName': 'guid', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'guid', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        with table.batch_writer() as batch:
+            for _ in range(items):
+                batch.put_item(Item=make_item(metadata_keys))
+        yield table
+
+
+@contextmanager
+def local_table(backend: str, items: int, metadata_keys: int = 4, table_name: str = 'models'):
+    """ A local backend of backends.py filled with generated items, in place of mock_table
+
+    Yields:
+        LocalBackend: the backend, which answers the calls of a boto3 table
+    """
+    from backends import local_backend
+    table = local_backend(backend, table_name, ':memory:')
+    for _ in range(items):
+        table.put_item(Item=make_item(metadata_keys))
+    yield table
+
+
+# the calls of a local backend that stand in for a round trip to dynamodb
+LOCAL_CALLS = ('get_item', 'put_item', 'update_item', 'delete_item', 'scan', 'query', 'batch_get_item', 'batch_write_item')
+
+def add_latency(client, latency_ms: float) -> None:
+    """ Sleeps after every dynamodb call made by client to stand in for the
+        network round trip moto does not have. Sleeping releases the GIL like real io.
+        Given a boto3 session instead, it delays the calls of every client made from it afterwards.
+        Given a local backend, it delays its calls, outside of the lock of the backend.
+    """
+    if latency_ms <= 0:
+        return
+    def sleep(**kwargs):
+        time.sleep(latency_ms / 1000.0)
+    if hasattr(client, 'meta') and not hasattr(client.meta, 'events'):
+        for name in LOCAL_CALLS:
+            setattr(client, name, _delayed(getattr(client, name), sleep))
+        return
+    events = client.meta.events if hasattr(client, 'meta') else client.events
+    events.register('after-call.dynamodb', sleep)
+
+def _delayed(call, sleep):
+    def delayed(*args, **kwargs):
+        result = call(*args, **kwargs)
+        sleep()
+        return result
+    return delayed
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def lambda_context():
+    """ A stand in for the LambdaContext the handlers are invoked with """
+    from collections import namedtuple
+    context = {
+        "function_name": "benchmark",
+        "memory_limit_in_mb": 128,
+        "invoked_function_arn": "arn:aws:lambda:us-east-1:123456789012:function:benchmark",
+        "aws_request_id": "52fdfc07-2182-154f-163f-5f0f9a621d72",
+    }
+    return namedtuple("LambdaContext", context.keys())(*context.values())
+
+
+def api_event(method: str, path: str, body: dict = None, query: dict = None, headers: dict = None) -> dict:
+    """ Builds a minimal api gateway v2 proxy event """
+    import json
+    return {
+        "version": "2.0",
+        "routeKey": "$default",
+        "rawPath": path,
+        "rawQueryString": "&".join(f"{k}={v}" for k, v in (query or {}).items()),
+        "headers": headers or {"content-type": "application/json"},
+        "queryStringParameters": query,
+        "requestContext": {
+            "accountId": "123456789012",
+            "apiId": "api-id",
+            "domainName": "id.execute-api.us-east-1.amazonaws.com",
+            "http": {"method": method, "path": path, "protocol": "HTTP/1.1", "sourceIp": "IP", "userAgent": "agent"},
+            "requestId": "id",
+            "routeKey": "$default",
+            "stage": "$default",
+            "time": "12/Mar/2020:19:03:58 +0000",
+            "timeEpoch": 1583348638390
+        },
+        "body": json.dumps(body) if body is not None else None,
+        "isBase64Encoded": False
+    }
+
+
+def cpu_per_call(fn, iterations: int) -> float:
+    """ Process cpu time in microseconds per call of fn, after one warm up call """
+    fn()
+    start = time.process_time()
+    for _ in range(iterations):
+        fn()
+    return (time.process_time() - start) / iterations * 1e6
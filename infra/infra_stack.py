@@ -23,7 +23,7 @@ class InfraStack(core.Stack):
         any events put to eventbridge by the event lambda. 
 
         Attributes:
-            ddb_table (DyanmoDB): dynamodb table with a primary key
+            ddb_table (DyanmoDB): dynamodb table with a primary key and a global secondary index on name
             fn_layer (Lambda Layer): a lambda layer with the import requirements for the lambda
             api_lambda (Lambda): a lambda to handle api requests
             evt_lambda (Lambda): a lambda to handle dynamodb stream events
@@ -49,6 +49,16 @@ class InfraStack(core.Stack):
             ),
             stream=ddb.StreamViewType.NEW_AND_OLD_IMAGES
         )
+        # index to look models up by name with a query instead of a scan
+        name_index = "name-index"
+        ddb_table.add_global_secondary_index(
+            index_name=name_index,
+            partition_key=ddb.Attribute(
+                name='name',
+                type=ddb.AttributeType.STRING
+            ),
+            projection_type=ddb.ProjectionType.ALL
+        )
 
         # create a layer for the lambda required imports
         fn_layer = aws_lambda.LayerVersion(
@@ -68,7 +78,8 @@ class InfraStack(core.Stack):
             timeout=core.Duration.seconds(30),
             layers=[fn_layer],
             environment = {
-                "DDB_TABLE_NAME":ddb_table.table_name
+                "DDB_TABLE_NAME":ddb_table.table_name,
+                "DDB_NAME_INDEX":name_index
             }
         )
         # create lambda to translate db-stream events to domain events
@@ -90,7 +101,8 @@ class InfraStack(core.Stack):
             ddb_table,
             starting_position=aws_lambda.StartingPosition.TRIM_HORIZON,
             batch_size=5,
-            bisect_batch_on_error=True,
+            # the handler returns the first record it failed on, so a retry resumes from there
+            report_batch_item_failures=True,
             retry_attempts=5
         )
         evt_lambda.add_event_source(ddb_evt_source)
@@ -1,83 +1,432 @@
-
 import os
 import json
 import base64
+import binascii
 import re
+import zlib
 from aws_lambda_powertools import Logger
 from aws_lambda_powertools.utilities.data_classes import APIGatewayProxyEventV2
-from aws_lambda_powertools.utilities.parser import parse
+from pydantic import ValidationError
 from aws_lambda_powertools.utilities.typing import LambdaContext
-from models import Model, ModelStore, Response, ModelError
-from typing import Any, Dict, List
+from models import Model, ModelStore, AsyncModelStore, ModelCache, Response, ModelError, BatchRequest
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
 
 log_level=os.environ.get("LOG_LEVEL", 'ERROR').upper()
 logger = Logger(service="model-api", level=log_level)
 
 ddb_table_name = os.environ.get('DDB_TABLE_NAME', "models")
+# global secondary index on name, names are looked up by scanning without it
+ddb_name_index = os.environ.get('DDB_NAME_INDEX', None)
+# a cache size of 0 disables the in-process model cache
+cache_size = int(os.environ.get('MODEL_CACHE_SIZE', 0))
+cache_ttl = float(os.environ.get('MODEL_CACHE_TTL', 30))
+# prefix of the api gateway route, stripped from the path before routing
+api_base_path = os.environ.get('API_BASE_PATH', "/api")
+# bodies smaller than this are never compressed, the saving is not worth the cpu
+compression_min_bytes = int(os.environ.get('COMPRESSION_MIN_BYTES', 1024))
+compression_level = int(os.environ.get('COMPRESSION_LEVEL', 5))
 
 model_store = None
+async_store = None
+# event loop of async_router, kept for the life of the container
+event_loop = None
+
+# regex to match any uuid str in its canonical form, which is how Model stores a guid,
+# compiled once per container
+uuidval = re.compile(r'[0-9a-f]{8}\-[0-9a-f]{4}\-[0-9a-f]{4}\-[0-9a-f]{4}\-[0-9a-f]{12}\Z', re.I)
+
+Handler = Callable[[APIGatewayProxyEventV2, Dict[str, str]], Dict[str, Any]]
+
+
+class RouteTable():
+    """ RouteTable maps an http method and a path template to a handler.
+        Templates are split into segments once, when they are added, and stored
+        in a tree keyed by segment so a lookup costs one dict access per segment
+        of the path, however many routes there are. A '{name}' segment matches
+        any segment and is passed to the handler as a path parameter, literal
+        segments take precedence over parameters.
+    """
+    def __init__(self) -> None:
+        self._root = self._node()
+
+    @staticmethod
+    def _node() -> Dict:
+        return {'literals': {}, 'param': None, 'methods': {}}
+
+    def add(self, method: str, template: str, handler: Handler) -> None:
+        node = self._root
+        for segment in self.split(template):
+            if segment.startswith('{') and segment.endswith('}'):
+                if node['param'] is None:
+                    node['param'] = (segment[1:-1], self._node())
+                node = node['param'][1]
+            else:
+                node = node['literals'].setdefault(segment, self._node())
+        node['methods'][method.upper()] = handler
+
+    def match(self, method: str, path: str) -> Tuple[Optional[Handler], Dict[str, str], List[str]]:
+        """ Finds the handler for a request
+
+        Args:
+            method (str): the http method of the request
+            path (str): the path of the request, without the api base path
+
+        Returns:
+            Tuple: the handler or None, the path parameters, and the methods the
+                path supports, which is empty when the path is unknown
+        """
+        node = self._root
+        params = {}
+        for segment in self.split(path):
+            child = node['literals'].get(segment, None)
+            if child is None:
+                if node['param'] is None:
+                    return None, {}, []
+                name, child = node['param']
+                params[name] = segment
+            node = child
+        return node['methods'].get(method.upper(), None), params, sorted(node['methods'])
+
+    @staticmethod
+    def split(path: str) -> List[str]:
+        return [segment for segment in path.split('/') if segment]
+
+
+def route_path(raw_path: str) -> str:
+    """ Strips the api base path from the raw path of a request """
+    if api_base_path and (raw_path == api_base_path or raw_path.startswith(api_base_path + '/')):
+        return raw_path[len(api_base_path):]
+    return raw_path
+
+def parse_body(event: APIGatewayProxyEventV2) -> Dict:
+    """ Decodes the json body of a request
+
+    Raises:
+        ValueError: if the body is not a json object
+
+    Returns:
+        Dict: the body or an empty dict if there is none
+    """
+    if event.body is None:
+        return dict()
+    try:
+        if event.is_base64_encoded: # get with a body passed in is encoded
+            body = json.loads(base64.b64decode(event.body))
+        else:
+            body = json.loads(event.body)
+    except (binascii.Error, UnicodeError, ValueError) as e:
+        raise ValueError(f"body is not valid json: {e}")
+    if not isinstance(body, dict):
+        raise ValueError("body must be a json object")
+    return body
+
+# zlib window bits of each supported content coding, in order of preference
+content_codings = {'gzip': 31, 'deflate': 15}
+
+def accepted_coding(accept_encoding: Optional[str]) -> Optional[str]:
+    """ Picks the content coding to compress a response with from an
+        Accept-Encoding header, honouring q values of 0
+
+    Returns:
+        str: 'gzip', 'deflate' or None for identity
+    """
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for part in accept_encoding.split(','):
+        coding, _, params = part.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip().lower()] = q
+    for coding in content_codings:
+        if accepted.get(coding, accepted.get('*', 0)) > 0:
+            return coding
+    return None
+
+def compress_response(me: Dict[str, Any], accept_encoding: Optional[str]) -> Dict[str, Any]:
+    """ Compresses the body of a dumped response when the client accepts it
+        and the body is at least compression_min_bytes. A compressed body is
+        base64 encoded as api gateway requires, so it is only used when that is
+        still smaller than the plain body.
+
+    Args:
+        me (Dict[str, Any]): a dumped response
+        accept_encoding (str): the Accept-Encoding header of the request
+
+    Returns:
+        Dict[str, Any]: the response, with a compressed body when worthwhile
+    """
+    body = me.get('body', '')
+    if me.get('isBase64Encoded') or len(body) < compression_min_bytes:
+        return me
+    me['headers'] = {**me['headers'], "Vary": "Accept-Encoding"}
+    coding = accepted_coding(accept_encoding)
+    if coding is None:
+        return me
+    compressor = zlib.compressobj(compression_level, zlib.DEFLATED, content_codings[coding])
+    compressed = base64.b64encode(compressor.compress(body.encode('utf-8')) + compressor.flush()).decode('ascii')
+    if len(compressed) >= len(body):
+        return me
+    me['headers']["Content-Encoding"] = coding
+    me['isBase64Encoded'] = True
+    me['body'] = compressed
+    return me
+
+def entity_tags(if_none_match: Optional[str]) -> Optional[Set[str]]:
+    """ Parses an If-Match or If-None-Match header into the revisions it lists.
+        Weak tags are compared as strong ones, a revision names the whole model.
+
+    Returns:
+        Set[str]: the unquoted tags, '*' for any, or None if there is no header
+    """
+    if not if_none_match:
+        return None
+    tags = set()
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        tag = tag.strip('"')
+        if tag:
+            tags.add(tag)
+    return tags or None
+
+def error_response(status: int, title: str, detail: str) -> Response:
+    response = Response()
+    response.add_model_error(ModelError(status=status, title=title, detail=detail))
+    return response
+
+def request_model(event: APIGatewayProxyEventV2, params: Dict[str, str]) -> Tuple[Optional[Model], bool, Optional[Response]]:
+    """ Parses the body of a request into a Model, a guid in the path replaces
+        any guid in the body.
+
+    Returns:
+        Tuple: the model, whether the request named a guid, and an error response if the request is invalid
+    """
+    try:
+        body = parse_body(event)
+    except ValueError as e:
+        return None, False, error_response(400, "invalid request body", str(e))
+    if 'guid' in params:
+        if uuidval.match(params['guid']) is None:
+            return None, False, error_response(400, "invalid guid", f"guid: {params['guid']} is not a uuid")
+        body['guid'] = params['guid']
+    # need to catch empty guid for get all, but also create new Model with new guid when post
+    has_guid = bool(body.get('guid', None))
+    try:
+        # parse event.body into a Model will create a new guid if none exists
+        model: Model = Model.parse_obj(body)
+    except ValidationError as ve:
+        return None, False, error_response(400, "invalid model", str(ve))
+    return model, has_guid, None
+
+
+def request_guid(event: APIGatewayProxyEventV2, params: Dict[str, str]) -> Tuple[Optional[str], Optional[Response]]:
+    """ Finds the guid a read or delete is for without building a Model,
+        a bodiless request is never decoded. A guid in the path replaces any
+        guid in the body.
+
+    Returns:
+        Tuple: the guid in canonical form or None, and an error response if it is invalid
+    """
+    if 'guid' in params:
+        guid = params['guid']
+        if uuidval.match(guid) is None:
+            return None, error_response(400, "invalid guid", f"guid: {guid} is not a uuid")
+        return guid.lower(), None
+    if event.body is None:
+        return None, None
+    try:
+        guid = parse_body(event).get('guid', None)
+    except ValueError as e:
+        return None, error_response(400, "invalid request body", str(e))
+    if not guid:
+        return None, None
+    if not isinstance(guid, str) or uuidval.match(guid) is None:
+        return None, error_response(400, "invalid guid", f"guid: {guid} is not a uuid")
+    return guid.lower(), None
+
+
+def get_models(event: APIGatewayProxyEventV2, params: Dict[str, str]) -> Dict[str, Any]:
+    """ GET one model by guid, many by a list of guids, or a page of all of them """
+    query_string_parameters = event.query_string_parameters or {}
+    guid, error = request_guid(event, params)
+    if error is not None:
+        return error.dump()
+    if guid is not None: # looking for one model, unless the client holds it already
+        if_none_match = entity_tags(event.get_header_value('if-none-match'))
+        return model_store.get_by_guid(guid, query_string_parameters, if_none_match).dump()
+    if query_string_parameters.get('guids'): # looking for a list of models
+        guids = [g for g in query_string_parameters['guids'].split(',') if g]
+        return model_store.batch_get(guids, query_string_parameters).dump()
+    if query_string_parameters.get('format') == 'ndjson': # stream all the models as json lines
+        response = Response()
+        return response.dump_ndjson(model_store.stream_all(query_string_parameters, response))
+    if query_string_parameters.get('name'): # looking for models by name
+        return model_store.find_by_name(query_string_parameters['name'], query_string_parameters).dump()
+    # want all the models
+    return model_store.get_all(query_string_parameters).dump()
+
+def post_model(event: APIGatewayProxyEventV2, params: Dict[str, str]) -> Dict[str, Any]:
+    """ POST create new not idempotent """
+    model, _, error = request_model(event, params)
+    if error is not None:
+        return error.dump()
+    return model_store.post(model, event.query_string_parameters).dump()
+
+def patch_model(event: APIGatewayProxyEventV2, params: Dict[str, str]) -> Dict[str, Any]:
+    """ PATCH update a known """
+    model, _, error = request_model(event, params)
+    if error is not None:
+        return error.dump()
+    if_match = entity_tags(event.get_header_value('if-match'))
+    return model_store.patch(model, event.query_string_parameters, if_match).dump()
+
+def delete_model(event: APIGatewayProxyEventV2, params: Dict[str, str]) -> Dict[str, Any]:
+    """ DELETE remove """
+    guid, error = request_guid(event, params)
+    if error is None and guid is None:
+        error = error_response(400, "missing guid", "a delete needs the guid of the model")
+    if error is not None:
+        return error.dump()
+    return model_store.delete_by_guid(guid, event.query_string_parameters).dump()
+
+def get_model_metadata(event: APIGatewayProxyEventV2, params: Dict[str, str]) -> Dict[str, Any]:
+    """ GET only the guid and metadata of one model """
+    guid, error = request_guid(event, params)
+    if error is not None:
+        return error.dump()
+    query_string_parameters = {**(event.query_string_parameters or {}), 'fields': 'guid,metadata'}
+    if_none_match = entity_tags(event.get_header_value('if-none-match'))
+    return model_store.get_by_guid(guid, query_string_parameters, if_none_match).dump()
+
+def post_batch(event: APIGatewayProxyEventV2, params: Dict[str, str]) -> Dict[str, Any]:
+    """ POST to models/batch applies a list of writes in one call """
+    try:
+        batch: BatchRequest = BatchRequest.parse_obj(parse_body(event))
+    except (ValueError, ValidationError) as e:
+        return error_response(400, "invalid batch request", str(e)).dump()
+    return model_store.batch_write(batch, event.query_string_parameters).dump()
+
+
+# the route table is built once per container
+routes = RouteTable()
+routes.add('GET', '/models', get_models)
+routes.add('POST', '/models', post_model)
+routes.add('PATCH', '/models', patch_model)
+routes.add('DELETE', '/models', delete_model)
+routes.add('POST', '/models/batch', post_batch)
+routes.add('GET', '/models/{guid}', get_models)
+routes.add('PATCH', '/models/{guid}', patch_model)
+routes.add('DELETE', '/models/{guid}', delete_model)
+routes.add('GET', '/models/{guid}/metadata', get_model_metadata)
+
+
+async def get_models_async(event: APIGatewayProxyEventV2, params: Dict[str, str]) -> Dict[str, Any]:
+    """ GET as get_models, with the chunks of a list of guids read concurrently """
+    import asyncio
+    query_string_parameters = event.query_string_parameters or {}
+    if 'guid' not in params and event.body is None and query_string_parameters.get('guids'):
+        guids = [g for g in query_string_parameters['guids'].split(',') if g]
+        return (await async_store.batch_get(guids, query_string_parameters)).dump()
+    return await asyncio.get_running_loop().run_in_executor(None, get_models, event, params)
+
+async def post_batch_async(event: APIGatewayProxyEventV2, params: Dict[str, str]) -> Dict[str, Any]:
+    """ POST to models/batch as post_batch, with the chunks written concurrently """
+    try:
+        batch: BatchRequest = BatchRequest.parse_obj(parse_body(event))
+    except (ValueError, ValidationError) as e:
+        return error_response(400, "invalid batch request", str(e)).dump()
+    return (await async_store.batch_write(batch, event.query_string_parameters)).dump()
+
+# handlers replaced by arouter with ones that fan out, the others run off the event loop as they are
+async_handlers = {
+    get_models: get_models_async,
+    post_batch: post_batch_async,
+}
+
+
+def connect() -> None:
+    """ Makes the connection to dynamodb if not yet done """
+    global model_store
+    if model_store is None:
+        cache = ModelCache(cache_size, cache_ttl) if cache_size > 0 else None
+        model_store = ModelStore(ddb_table_name, cache=cache, name_index=ddb_name_index)
+    # counters are cumulative for the life of this container
+    if model_store.cache is not None:
+        logger.info({"model_cache": model_store.cache.stats()})
+
+def match_route(event: APIGatewayProxyEventV2) -> Tuple[Optional[Handler], Dict[str, str], Optional[Dict[str, Any]]]:
+    """ Finds the handler of a request
+
+    Returns:
+        Tuple: the handler, the path parameters, and the dumped error response if the route is unknown
+    """
+    method = event.request_context.http.method
+    handler, params, allowed = routes.match(method, route_path(event.raw_path))
+    # unknown routes are answered without looking at the body
+    if handler is None:
+        if not allowed:
+            response = error_response(
+                404,
+                "wrong path endpoint requested",
+                f"the path requested {event.raw_path} is not a known endpoint"
+            )
+        else:
+            response = error_response(
+                405,
+                "wrong Operation requested",
+                f"the operations requested: {method} is not supported on {event.raw_path}"
+            )
+            response.headers = {**response.headers, "Allow": ", ".join(allowed)}
+        return None, {}, response.dump()
+    return handler, params, None
+
 
 #decorator logs context info and the full event ( default event logging is false)
 @logger.inject_lambda_context(log_event=True)
 def router(event: Dict[str, Any], context: LambdaContext) -> Dict[str, Any]:
-    global model_store
-    # make the connection to dynamodb if not yet done.
-    if model_store is None:
-        model_store = ModelStore(ddb_table_name)
-    
+    connect()
     # use powertools to structure and validate event
     event: APIGatewayProxyEventV2 = APIGatewayProxyEventV2(event)
-    request_context = event.request_context
-    query_string_parameters = event.query_string_parameters
-    # regex to match a proper uuid4 str 
-    uuid4val = re.compile(r'[0-9a-f]{8}\-[0-9a-f]{4}\-4[0-9a-f]{3}\-[89ab][0-9a-f]{3}\-[0-9a-f]{12}\Z', re.I)
-    response = Response()
-    if 'models' in event.raw_path:
-        logger.info(event.body)
-        if event.body is None: # should happen with a get so we check for an Id in path
-            body = dict()
-            guid = os.path.basename(event.raw_path)
-            if uuid4val.match(guid) is not None:
-                body['guid'] = guid
-        else:
-            if event.is_base64_encoded: # get with a body passed in is encoded
-                body = json.loads(base64.b64decode(event.body))
-            else:
-                body = json.loads(event.body)
-
-        # need to catch empty guid for get all, but also create new Model with new guid when post
-        has_guid = bool(body.get('guid', None))
-        # use powertools to parse event.body into a Model will create a new guid if none exists
-        model: Model = parse(event=body, model=Model)
-        
-        # POST create new not idempotent
-        if request_context.http.method == 'POST':
-            response = model_store.post(model, query_string_parameters)
-        # GET one or all
-        elif request_context.http.method == 'GET':
-            if has_guid: # looking for one model
-                response = model_store.get(model, query_string_parameters)
-            else: # want all the models
-                response = model_store.get_all(query_string_parameters)
-        # PATCH update a known 
-        elif request_context.http.method == 'PATCH':
-            response = model_store.patch(model, query_string_parameters)
-        # DELETE remove
-        elif request_context.http.method == 'DELETE':
-            response = model_store.delete(model, query_string_parameters)
-        else:
-            err = ModelError(
-                status=400,
-                title="wrong Operation requested",
-                detail=f"the operations requested: {request_context.http.method} is not supported"
-            )
-            response.add_model_error(err)
+    handler, params, error = match_route(event)
+    if error is not None:
+        return error
+    logger.info(event.body)
+    return compress_response(handler(event, params), event.get_header_value('accept-encoding'))
+
+async def arouter(event: Dict[str, Any], context: LambdaContext) -> Dict[str, Any]:
+    """ The router for asyncio code. Requests that fan out to many dynamodb calls,
+        a list of guids or a batch write, issue them concurrently through an
+        AsyncModelStore, the others are handled as router does off the event loop.
+    """
+    import asyncio
+    global async_store
+    connect()
+    if async_store is None or async_store.store is not model_store:
+        async_store = AsyncModelStore(model_store)
+    event: APIGatewayProxyEventV2 = APIGatewayProxyEventV2(event)
+    handler, params, error = match_route(event)
+    if error is not None:
+        return error
+    logger.info(event.body)
+    if handler in async_handlers:
+        me = await async_handlers[handler](event, params)
     else:
-        err = ModelError(
-            status=400,
-            title="wrong path endpoint requested",
-            detail=f"the path requested {event.raw_path} does not contain 'models'"
-        )
-        response.add_model_error(err)
-    return response.dump()
\ No newline at end of file
+        me = await asyncio.get_running_loop().run_in_executor(None, handler, event, params)
+    return compress_response(me, event.get_header_value('accept-encoding'))
+
+@logger.inject_lambda_context(log_event=True)
+def async_router(event: Dict[str, Any], context: LambdaContext) -> Dict[str, Any]:
+    """ Lambda handler that runs arouter, an alternative to router for requests that fan out """
+    import asyncio
+    global event_loop
+    if event_loop is None:
+        event_loop = asyncio.new_event_loop()
+    return event_loop.run_until_complete(arouter(event, context))
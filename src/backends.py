@@ -0,0 +1,484 @@
+""" Storage backends that stand in for the dynamodb table of a ModelStore.
+
+    A ModelStore keeps its models through the table interface of boto3: get_item,
+    put_item, update_item, delete_item, scan and query on the table, and
+    batch_get_item, batch_write_item and a segmented scan on its meta.client.
+    The boto3 Table is the dynamodb backend. The backends here implement the same
+    calls in process, evaluating the boto3 conditions and the expressions a
+    ModelStore writes, and raising the same ClientErrors, so a ModelStore behaves
+    the same on any of them without a round trip. Values are checked as boto3 checks
+    them before a write is sent, so a float raises its TypeError, but the checks
+    dynamodb makes on its side, such as the size of an item or an empty string as
+    the key of an index, are not made:
+
+    - MemoryBackend: a dict of items, shared by the stores of a container
+    - SQLiteBackend: a sqlite database file, items stored as json
+
+    They are meant for load tests and profiling of the lambdas, not for production.
+    A table is scanned in order of guid, and a Limit counts the items read before a
+    FilterExpression is applied, as it does in dynamodb.
+"""
+import copy
+import json
+import re
+import sqlite3
+import zlib
+from abc import ABC, abstractmethod
+from bisect import bisect_right, insort
+from decimal import Decimal
+from threading import RLock
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from boto3.dynamodb.conditions import AttributeBase, ConditionBase
+from boto3.dynamodb.types import TypeSerializer
+from botocore.exceptions import ClientError
+
+
+def client_error(code: str, message: str, operation: str) -> ClientError:
+    """ Builds the ClientError dynamodb would raise """
+    return ClientError(
+        {'Error': {'Code': code, 'Message': message}, 'ResponseMetadata': {'HTTPStatusCode': 400}},
+        operation
+    )
+
+_serializer = TypeSerializer()
+
+def check_values(values: Iterable[Any]) -> None:
+    """ Serializes values as boto3 does before a write is sent, which checks their types
+
+    Raises:
+        TypeError: as boto3 does, for a float or another type dynamodb can not store
+    """
+    for value in values:
+        _serializer.serialize(value)
+
+# a missing attribute, told apart from one holding None
+_MISSING = object()
+
+def _resolve(item: Dict, path: List[str]) -> Any:
+    value = item
+    for name in path:
+        if not isinstance(value, dict) or name not in value:
+            return _MISSING
+        value = value[name]
+    return value
+
+def _split(path: str, names: Optional[Dict[str, str]] = None) -> List[str]:
+    """ Splits a document path on its dots, replacing the #name placeholders """
+    names = names or {}
+    return [names.get(part.strip(), part.strip()) for part in path.split('.')]
+
+def _compare(op: str, a: Any, b: Any) -> bool:
+    if a is _MISSING:
+        return op == '<>'
+    try:
+        if op == '=':
+            return a == b
+        if op == '<>':
+            return a != b
+        if op == '<':
+            return a < b
+        if op == '<=':
+            return a <= b
+        if op == '>':
+            return a > b
+        if op == '>=':
+            return a >= b
+    except TypeError:
+        return False
+    raise ValueError(f"unknown comparison: {op}")
+
+def evaluate(condition: ConditionBase, item: Optional[Dict]) -> bool:
+    """ Evaluates a boto3 condition, a ConditionExpression, FilterExpression or
+        KeyConditionExpression, against an item. A missing item has no attributes.
+    """
+    item = item or {}
+    op = condition.expression_operator
+    values = condition.get_expression()['values']
+    if op == 'AND':
+        return evaluate(values[0], item) and evaluate(values[1], item)
+    if op == 'OR':
+        return evaluate(values[0], item) or evaluate(values[1], item)
+    if op == 'NOT':
+        return not evaluate(values[0], item)
+    value = _resolve(item, _split(values[0].name))
+    if op == 'attribute_exists':
+        return value is not _MISSING
+    if op == 'attribute_not_exists':
+        return value is _MISSING
+    operands = [_resolve(item, _split(v.name)) if isinstance(v, AttributeBase) else v for v in values[1:]]
+    if op == 'IN':
+        return value is not _MISSING and value in operands[0]
+    if op == 'BETWEEN':
+        return _compare('>=', value, operands[0]) and _compare('<=', value, operands[1])
+    if op == 'begins_with':
+        return isinstance(value, str) and value.startswith(operands[0])
+    if op == 'contains':
+        return value is not _MISSING and operands[0] in value
+    return _compare(op, value, operands[0])
+
+def project(item: Dict, projection: Optional[str], names: Optional[Dict[str, str]]) -> Dict:
+    """ Applies a ProjectionExpression of top level attributes to an item """
+    if not projection:
+        return item
+    attributes = {_split(path, names)[0] for path in projection.split(',')}
+    return {k: v for k, v in item.items() if k in attributes}
+
+# the clauses of an update expression, split on their keywords
+_CLAUSE = re.compile(r'\b(SET|REMOVE|ADD|DELETE)\b')
+
+def apply_update(item: Dict, expression: str, names: Dict[str, str], values: Dict[str, Any]) -> List[List[str]]:
+    """ Applies the SET, REMOVE and ADD clauses of an UpdateExpression to an item
+        in place. SET only assigns values, the functions of SET are not supported.
+
+    Raises:
+        ClientError: ValidationException if a path is inside a map that does not exist
+
+    Returns:
+        List[List[str]]: the paths updated
+    """
+    parts = _CLAUSE.split(expression)
+    updated = []
+    for keyword, clause in zip(parts[1::2], parts[2::2]):
+        for action in (a.strip() for a in clause.split(',') if a.strip()):
+            if keyword == 'SET':
+                path, _, value = (s.strip() for s in action.partition('='))
+                path = _split(path, names)
+                _parent(item, path)[path[-1]] = copy.deepcopy(values[value])
+            elif keyword == 'REMOVE':
+                path = _split(action, names)
+                _parent(item, path).pop(path[-1], None)
+            elif keyword == 'ADD':
+                path, value = action.split()
+                path = _split(path, names)
+                parent = _parent(item, path)
+                parent[path[-1]] = parent.get(path[-1], 0) + values[value]
+            else:
+                raise client_error('ValidationException', f"{keyword} is not supported", 'UpdateItem')
+            updated.append(path)
+    return updated
+
+def _parent(item: Dict, path: List[str]) -> Dict:
+    parent = _resolve(item, path[:-1])
+    if not isinstance(parent, dict):
+        raise client_error(
+            'ValidationException',
+            "The document path provided in the update expression is invalid for update",
+            'UpdateItem'
+        )
+    return parent
+
+def _pick(item: Dict, paths: List[List[str]]) -> Dict:
+    """ The values of the paths in an item, nested as they are in it """
+    picked = {}
+    for path in paths:
+        value = _resolve(item, path)
+        if value is _MISSING:
+            continue
+        target = picked
+        for name in path[:-1]:
+            target = target.setdefault(name, {})
+        target[path[-1]] = copy.deepcopy(value)
+    return picked
+
+def _segment(guid: str, total_segments: int) -> int:
+    return zlib.crc32(guid.encode('utf-8')) % total_segments
+
+
+class LocalBackend(ABC):
+    """ LocalBackend implements the table interface of boto3 used by ModelStore
+        over a store of items kept in order of guid. Subclasses provide the store.
+        Operations are serialized with a lock, so the backend can be shared by
+        the worker threads of an AsyncModelStore.
+
+        Attributes:
+            name (str): the name of the table
+            meta: stands in for the meta of a boto3 table, its client is the backend itself
+    """
+    def __init__(self, name: str = 'models') -> None:
+        self.name = name
+        self.meta = SimpleNamespace(client=self)
+        self._lock = RLock()
+        self._listeners: List[Callable[[str, Optional[Dict], Optional[Dict]], None]] = []
+
+    def subscribe(self, listener: Callable[[str, Optional[Dict], Optional[Dict]], None]) -> None:
+        """ Calls listener with the event name, INSERT, MODIFY or REMOVE, and the old
+            and new item of every change, in the order they are made, as a dynamodb
+            stream of NEW_AND_OLD_IMAGES carries them. It is called under the lock of
+            the backend, so it should only hand the change over.
+        """
+        self._listeners.append(listener)
+
+    def _write(self, old: Optional[Dict], new: Optional[Dict]) -> None:
+        """ Saves or removes an item and tells the listeners """
+        if new is not None:
+            self._save(new)
+        else:
+            self._remove(old['guid'])
+        if self._listeners:
+            name = 'INSERT' if old is None else 'REMOVE' if new is None else 'MODIFY'
+            for listener in self._listeners:
+                listener(name, old, copy.deepcopy(new))
+
+    # the store of items, implemented by the subclasses
+
+    @abstractmethod
+    def _load(self, guid: str) -> Optional[Dict]:
+        """ Returns a copy of the item with guid, None if there is none """
+
+    @abstractmethod
+    def _save(self, item: Dict) -> None:
+        """ Stores a copy of the item, replacing any with its guid """
+
+    @abstractmethod
+    def _remove(self, guid: str) -> None:
+        """ Removes the item with guid, if there is one """
+
+    @abstractmethod
+    def _iter_after(self, guid: Optional[str]) -> Iterator[Dict]:
+        """ Yields the items in order of guid, starting after guid when it is given """
+
+    # the table
+
+    def get_item(self, Key: Dict, ProjectionExpression: str = None, ExpressionAttributeNames: Dict = None, **kwargs) -> Dict:
+        with self._lock:
+            item = self._load(Key['guid'])
+        if item is None:
+            return {}
+        return {'Item': project(item, ProjectionExpression, ExpressionAttributeNames)}
+
+    def put_item(self, Item: Dict, ConditionExpression: ConditionBase = None, ReturnValues: str = 'NONE', **kwargs) -> Dict:
+        check_values(Item.values())
+        with self._lock:
+            old = self._load(Item['guid'])
+            self._check(ConditionExpression, old, 'PutItem')
+            self._write(old, Item)
+        return {'Attributes': old} if ReturnValues == 'ALL_OLD' and old else {}
+
+    def update_item(self, Key: Dict, UpdateExpression: str, ConditionExpression: ConditionBase = None,
+                    ExpressionAttributeNames: Dict = None, ExpressionAttributeValues: Dict = None,
+                    ReturnValues: str = 'NONE', **kwargs) -> Dict:
+        check_values((ExpressionAttributeValues or {}).values())
+        with self._lock:
+            old = self._load(Key['guid'])
+            self._check(ConditionExpression, old, 'UpdateItem')
+            item = copy.deepcopy(old) if old is not None else dict(Key)
+            paths = apply_update(item, UpdateExpression, ExpressionAttributeNames or {}, ExpressionAttributeValues or {})
+            self._write(old, item)
+        if ReturnValues == 'ALL_OLD':
+            attributes = old or {}
+        elif ReturnValues == 'ALL_NEW':
+            attributes = item
+        elif ReturnValues == 'UPDATED_OLD':
+            attributes = _pick(old or {}, paths)
+        elif ReturnValues == 'UPDATED_NEW':
+            attributes = _pick(item, paths)
+        else:
+            attributes = {}
+        return {'Attributes': attributes} if attributes else {}
+
+    def delete_item(self, Key: Dict, ConditionExpression: ConditionBase = None, ReturnValues: str = 'NONE', **kwargs) -> Dict:
+        with self._lock:
+            old = self._load(Key['guid'])
+            self._check(ConditionExpression, old, 'DeleteItem')
+            if old is not None:
+                self._write(old, None)
+        return {'Attributes': old} if ReturnValues == 'ALL_OLD' and old else {}
+
+    def scan(self, Limit: int = None, ExclusiveStartKey: Dict = None, FilterExpression: ConditionBase = None,
+             ProjectionExpression: str = None, ExpressionAttributeNames: Dict = None,
+             Segment: int = None, TotalSegments: int = None, **kwargs) -> Dict:
+        return self._read(None, Limit, ExclusiveStartKey, FilterExpression, ProjectionExpression,
+                          ExpressionAttributeNames, Segment, TotalSegments)
+
+    def query(self, KeyConditionExpression: ConditionBase, IndexName: str = None, Limit: int = None,
+              ExclusiveStartKey: Dict = None, FilterExpression: ConditionBase = None,
+              ProjectionExpression: str = None, ExpressionAttributeNames: Dict = None, **kwargs) -> Dict:
+        """ A query on any index reads the table in order of guid, keeping the
+            items that match the key condition, they do not count to the Limit
+        """
+        return self._read(KeyConditionExpression, Limit, ExclusiveStartKey, FilterExpression,
+                          ProjectionExpression, ExpressionAttributeNames)
+
+    def _read(self, key_condition: Optional[ConditionBase], limit: Optional[int], start_key: Optional[Dict],
+              filter_expression: Optional[ConditionBase], projection: Optional[str], names: Optional[Dict],
+              segment: int = None, total_segments: int = None) -> Dict:
+        items = []
+        last = None
+        read = 0
+        with self._lock:
+            for item in self._iter_after((start_key or {}).get('guid', None)):
+                if total_segments and _segment(item['guid'], total_segments) != segment:
+                    continue
+                if key_condition is not None and not evaluate(key_condition, item):
+                    continue
+                if limit is not None and read >= limit:
+                    break
+                read += 1
+                last = item
+                if filter_expression is None or evaluate(filter_expression, item):
+                    items.append(project(item, projection, names))
+            else:
+                last = None
+        resp = {'Items': items, 'Count': len(items), 'ScannedCount': read}
+        if last is not None:
+            resp['LastEvaluatedKey'] = {'guid': last['guid']}
+        return resp
+
+    @staticmethod
+    def _check(condition: Optional[ConditionBase], item: Optional[Dict], operation: str) -> None:
+        if condition is not None and not evaluate(condition, item):
+            raise client_error('ConditionalCheckFailedException', "The conditional request failed", operation)
+
+    # the client
+
+    def batch_get_item(self, RequestItems: Dict, **kwargs) -> Dict:
+        request = RequestItems[self.name]
+        responses = []
+        with self._lock:
+            for key in request['Keys']:
+                item = self._load(key['guid'])
+                if item is not None:
+                    responses.append(project(item, request.get('ProjectionExpression'), request.get('ExpressionAttributeNames')))
+        return {'Responses': {self.name: responses}, 'UnprocessedKeys': {}}
+
+    def batch_write_item(self, RequestItems: Dict, **kwargs) -> Dict:
+        for request in RequestItems[self.name]:
+            if 'PutRequest' in request:
+                check_values(request['PutRequest']['Item'].values())
+        with self._lock:
+            for request in RequestItems[self.name]:
+                if 'PutRequest' in request:
+                    item = request['PutRequest']['Item']
+                    self._write(self._load(item['guid']), item)
+                else:
+                    old = self._load(request['DeleteRequest']['Key']['guid'])
+                    if old is not None:
+                        self._write(old, None)
+        return {'UnprocessedItems': {}}
+
+
+class MemoryBackend(LocalBackend):
+    """ MemoryBackend keeps the items in a dict, with a sorted list of their
+        guids for paging. Items are copied in and out, as they would be serialized.
+    """
+    def __init__(self, name: str = 'models') -> None:
+        super().__init__(name)
+        self._items: Dict[str, Dict] = {}
+        self._guids: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def _load(self, guid: str) -> Optional[Dict]:
+        item = self._items.get(guid, None)
+        return copy.deepcopy(item) if item is not None else None
+
+    def _save(self, item: Dict) -> None:
+        guid = item['guid']
+        if guid not in self._items:
+            insort(self._guids, guid)
+        self._items[guid] = copy.deepcopy(item)
+
+    def _remove(self, guid: str) -> None:
+        if self._items.pop(guid, None) is not None:
+            del self._guids[bisect_right(self._guids, guid) - 1]
+
+    def _iter_after(self, guid: Optional[str]) -> Iterator[Dict]:
+        start = bisect_right(self._guids, guid) if guid is not None else 0
+        for g in self._guids[start:]:
+            yield copy.deepcopy(self._items[g])
+
+
+def _json_default(o):
+    if isinstance(o, Decimal):
+        return int(o) if o == o.to_integral_value() else float(o)
+    if isinstance(o, set):
+        return list(o)
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+class SQLiteBackend(LocalBackend):
+    """ SQLiteBackend keeps the items as json in a sqlite table keyed by guid.
+        One connection is shared by the threads using the backend, under its lock.
+        Writes are committed as they are made.
+
+        Attributes:
+            path (str): the file of the database, ':memory:' for a private in memory one
+    """
+    def __init__(self, name: str = 'models', path: str = ':memory:') -> None:
+        super().__init__(name)
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        # the name is quoted as an identifier, it can not be a parameter
+        self._table = '"' + name.replace('"', '""') + '"'
+        self._db.execute(f"CREATE TABLE IF NOT EXISTS {self._table} (guid TEXT PRIMARY KEY, item TEXT NOT NULL)")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute(f"SELECT count(*) FROM {self._table}").fetchone()[0]
+
+    def _load(self, guid: str) -> Optional[Dict]:
+        row = self._db.execute(f"SELECT item FROM {self._table} WHERE guid = ?", (guid,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def _save(self, item: Dict) -> None:
+        self._db.execute(
+            f"INSERT OR REPLACE INTO {self._table} (guid, item) VALUES (?, ?)",
+            (item['guid'], json.dumps(item, default=_json_default))
+        )
+
+    def _remove(self, guid: str) -> None:
+        self._db.execute(f"DELETE FROM {self._table} WHERE guid = ?", (guid,))
+
+    def _iter_after(self, guid: Optional[str]) -> Iterator[Dict]:
+        # rows are fetched a page at a time, so a scan with a Limit reads little more than it needs
+        cursor = self._db.execute(
+            f"SELECT item FROM {self._table} WHERE guid > ? ORDER BY guid",
+            (guid if guid is not None else '',)
+        )
+        while True:
+            rows = cursor.fetchmany(100)
+            if not rows:
+                return
+            for row in rows:
+                yield json.loads(row[0])
+
+    def close(self) -> None:
+        self._db.close()
+
+
+# backends by kind, table name and database file, so every store of a container sees the same items
+_backends: Dict[Tuple[str, str, str], LocalBackend] = {}
+_registry_lock = RLock()
+
+def local_backend(kind: str, table_name: str = 'models', sqlite_path: str = ':memory:') -> LocalBackend:
+    """ Returns the backend a ModelStore uses in place of its dynamodb table.
+        Backends are made once per container, so the stores of a container,
+        including the workers of an AsyncModelStore, share them.
+
+    Args:
+        kind (str): 'memory' or 'sqlite'
+        table_name (str): the name of the table
+        sqlite_path (str): the database file of a sqlite backend
+
+    Raises:
+        ValueError: if the kind of backend is unknown
+
+    Returns:
+        LocalBackend: the backend
+    """
+    if kind not in ('memory', 'sqlite'):
+        raise ValueError(f"storage backend: {kind} is not one of dynamodb, memory or sqlite")
+    key = (kind, table_name, sqlite_path if kind == 'sqlite' else '')
+    with _registry_lock:
+        backend = _backends.get(key, None)
+        if backend is None:
+            if kind == 'memory':
+                backend = MemoryBackend(table_name)
+            else:
+                backend = SQLiteBackend(table_name, sqlite_path)
+            _backends[key] = backend
+        return backend
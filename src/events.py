@@ -5,60 +5,72 @@ from aws_lambda_powertools import Logger
 from aws_lambda_powertools.utilities.parser.models import DynamoDBStreamModel
 from aws_lambda_powertools.utilities.parser import parse
 from aws_lambda_powertools.utilities.typing import LambdaContext
-import boto3
-from botocore.exceptions import ClientError
-from models import Model, ModelChangeEvent, Response, ModelError
+from models import Model, ModelChangeEvent, ModelEventPublisher, Response, ModelError, aws_client
 
 
 log_level=os.environ.get("LOG_LEVEL", 'ERROR').upper()
 logger = Logger(service="model-events", level=log_level)
 
-eventbridge = None
+publisher = None
+
+# stream event names mapped to the event types of ModelChangeEvent
+event_types = {
+    'INSERT': 'CREATE',
+    'MODIFY': 'UPDATE',
+    'REMOVE': 'DELETE'
+}
 
 #decorator logs context info and the full event as json ( default event logging is false)
 @logger.inject_lambda_context(log_event=True)
 def dynamo_stream_handler(in_event: Dict[str, Any], context: LambdaContext) -> Dict[str, Any]:
     """ This method when registered as a lambda will handle incoming dynamodb stream events
         from a connected dynamodb. It transforms those events using the ModelChangeEvent model
-        and puts them out to eventbridge as a custom event. This way business logic for change 
-        events are encapsulated in the models package.
+        and puts them out to eventbridge as custom events, batched by the ModelEventPublisher.
+        This way business logic for change events are encapsulated in the models package.
 
     Args:
         in_event (Dict[str, Any]): the incoming event
         context (LambdaContext): the context
 
     Returns:
-        Dict[str, Any]: Response converted to dict, not typically consumed 
+        Dict[str, Any]: the batchItemFailures with the sequence number of the first record
+            whose event could not be put, so lambda retries the batch from that record on.
+            Events of the records after it may have been put already and are sent again.
     """
-    global eventbridge
-    if eventbridge is None:
-        eventbridge = boto3.client("events")
+    global publisher
+    if publisher is None:
+        publisher = ModelEventPublisher(aws_client("events"))
 
     response = Response()
     ddb_model: DynamoDBStreamModel = parse( model=DynamoDBStreamModel, event=in_event)
     logger.info(f"DynamodbStreamEvent Received: {ddb_model}")
+    out_events: List[ModelChangeEvent] = []
+    sequence_numbers: List[str] = []
     for record in ddb_model.Records:
-        out_event: ModelChangeEvent = None
-        if record.eventName == 'INSERT':
-            out_event=ModelChangeEvent.from_dynamodb_record("CREATE", record)
-        elif record.eventName == 'MODIFY':
-            out_event=ModelChangeEvent.from_dynamodb_record("UPDATE", record)
-        elif record.eventName == 'REMOVE':
-            out_event=ModelChangeEvent.from_dynamodb_record("DELETE", record)
-        try:
-            logger.info(out_event)
-            result = out_event.send(eventbridge)
-        except ClientError as ce:
-            response.add_boto_error(ce)
-            logger.error(ce)
-        except AttributeError as ae:
+        event_type = event_types.get(record.eventName, None)
+        if event_type is None:
             me = ModelError(
                 title= "Empty ModelChangeEvent Object",
                 status=500,
-                detail=str(ae)
+                detail=f"unsupported stream event: {record.eventName}"
             )
             response.add_model_error(me)
-            logger.error(ae)
+            logger.error(me)
+            continue
+        out_events.append(ModelChangeEvent.from_dynamodb_record(event_type, record))
+        sequence_numbers.append(record.dynamodb.SequenceNumber)
+
+    # events are put in batches rather than one call per record
+    results = publisher.publish(out_events)
+    batch_item_failures = []
+    for out_event, error, sequence_number in zip(out_events, results, sequence_numbers):
+        if error is not None:
+            response.add_model_error(error)
+            logger.error(error)
+            if not batch_item_failures:
+                batch_item_failures.append({"itemIdentifier": sequence_number})
         else:
-            logger.info(result)
-    return response.dump()
+            logger.info(out_event)
+    if response.body.errors:
+        logger.error(response.dump())
+    return {"batchItemFailures": batch_item_failures}
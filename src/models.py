@@ -1,13 +1,200 @@
-from datetime import datetime
+import io
+import os
+import json
+import time
+import random
+import base64
+import binascii
+import re
+import math
+from decimal import Decimal, DecimalException
 from uuid import UUID, uuid4
-from typing import List,Dict, Optional
+from queue import Queue, Full
+from collections import Counter, OrderedDict
+from functools import partial
+from threading import Event, Lock, local
+from typing import TYPE_CHECKING, Any, Callable, List,Dict, Iterable, Iterator, Literal, Optional, Set, Tuple
 import boto3
-from boto3.dynamodb.conditions import Attr
-from botocore.exceptions import ClientError
-from dynamodb_json import json_util 
+from boto3.dynamodb.conditions import Attr, Key
+from boto3.dynamodb.types import DYNAMODB_CONTEXT
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
 from aws_lambda_powertools import Logger
-from aws_lambda_powertools.utilities.parser import BaseModel, Field, validator
-from aws_lambda_powertools.utilities.parser.models import DynamoDBStreamRecordModel, DynamoDBStreamChangedRecordModel
+# the parser package imports every envelope model on import, the api lambda
+# only needs pydantic itself, which is what the parser re-exports
+from pydantic import BaseModel, Field, PrivateAttr, validator
+
+try:
+    # optional faster json encoder, the stdlib encoder is used without it
+    import orjson
+except ImportError:
+    orjson = None
+
+if TYPE_CHECKING:
+    # stream models are only needed by the events lambda
+    from aws_lambda_powertools.utilities.parser.models import DynamoDBStreamRecordModel
+
+# the region lambda runs in, so a table is never reached across regions by default
+aws_region = os.environ.get('AWS_REGION', os.environ.get('AWS_DEFAULT_REGION', "us-east-1"))
+# connection settings of every aws client made by a container
+boto_max_pool_connections = int(os.environ.get('BOTO_MAX_POOL_CONNECTIONS', 16))
+boto_connect_timeout = float(os.environ.get('BOTO_CONNECT_TIMEOUT', 1))
+boto_read_timeout = float(os.environ.get('BOTO_READ_TIMEOUT', 5))
+boto_max_attempts = int(os.environ.get('BOTO_MAX_ATTEMPTS', 3))
+boto_tcp_keepalive = os.environ.get('BOTO_TCP_KEEPALIVE', "true").lower() == "true"
+# where a ModelStore keeps its models: dynamodb, or memory or sqlite for local load tests
+storage_backend = os.environ.get('MODEL_STORE_BACKEND', "dynamodb").lower()
+sqlite_path = os.environ.get('MODEL_STORE_SQLITE_PATH', "/tmp/models.sqlite3")
+
+_session = None
+
+def aws_session() -> boto3.session.Session:
+    """ Returns the one boto3 session of the container. Credentials and service
+        models are loaded by it once and shared by every client made from it.
+    """
+    global _session
+    if _session is None:
+        _session = boto3.session.Session()
+    return _session
+
+def client_config() -> Config:
+    """ Builds the botocore config of the aws clients from the BOTO_* environment.
+        Connections are pooled and kept alive between invocations, timeouts are
+        short so a stalled connection is retried rather than waited on.
+    """
+    settings = dict(
+        max_pool_connections=boto_max_pool_connections,
+        connect_timeout=boto_connect_timeout,
+        read_timeout=boto_read_timeout,
+        retries={'max_attempts': boto_max_attempts, 'mode': 'standard'},
+    )
+    try:
+        return Config(tcp_keepalive=boto_tcp_keepalive, **settings)
+    except TypeError:
+        # botocore older than 1.27.84 has no tcp_keepalive
+        return Config(**settings)
+
+def dynamodb_resource(region: str = None):
+    """ Makes a dynamodb resource from the shared session and client config
+
+    Args:
+        region (str): (Optional) defaults to the region of the lambda
+
+    Returns:
+        ServiceResource: the dynamodb resource
+    """
+    return aws_session().resource('dynamodb', region_name=region or aws_region, config=client_config())
+
+def aws_client(service_name: str, region: str = None):
+    """ Makes a client of an aws service from the shared session and client config
+
+    Args:
+        service_name (str): the name of the service, such as 'events'
+        region (str): (Optional) defaults to the region of the lambda
+
+    Returns:
+        BaseClient: the client
+    """
+    return aws_session().client(service_name, region_name=region or aws_region, config=client_config())
+
+
+def _decode_number(n: str):
+    try:
+        return int(n)
+    except ValueError:
+        return float(n)
+
+# decoders of a dynamodb attribute value by its type descriptor
+_attribute_decoders = {
+    'S': lambda v: v,
+    'N': _decode_number,
+    'BOOL': lambda v: v,
+    'NULL': lambda v: None,
+    'M': lambda v: {name: decode_attribute_value(value) for name, value in v.items()},
+    'L': lambda v: [decode_attribute_value(value) for value in v],
+    'B': lambda v: v,
+    'SS': list,
+    'NS': lambda v: [_decode_number(n) for n in v],
+    'BS': list,
+}
+
+def decode_attribute_value(value: Dict):
+    """ Decodes a dynamodb json attribute value, as found in stream images, into
+        python types: S to str, N to int or float, M to dict, L and sets to list,
+        BOOL to bool and NULL to None. Binary values are left base64 encoded.
+        Unlike a round trip through json text it walks the value once.
+
+    Args:
+        value (Dict): an attribute value of the form {type: value}
+
+    Raises:
+        ValueError: if the type descriptor is unknown
+
+    Returns:
+        the python value
+    """
+    for type_, v in value.items():
+        decoder = _attribute_decoders.get(type_, None)
+        if decoder is None:
+            raise ValueError(f"unknown dynamodb attribute type: {type_}")
+        return decoder(v)
+    raise ValueError("empty dynamodb attribute value")
+
+
+def to_dynamodb(value: Any) -> Any:
+    """ Converts the floats in a value, as json numbers with a fraction are decoded,
+        to the Decimals boto3 writes numbers from, it raises a TypeError on a float.
+
+    Args:
+        value: dicts, lists and scalars to write to dynamodb
+
+    Raises:
+        ValueError: if a number is not finite or out of the range dynamodb stores
+
+    Returns:
+        the value with Decimals in place of floats
+    """
+    if isinstance(value, float):
+        if not math.isfinite(value):
+            raise ValueError(f"{value} is not a number dynamodb can store")
+        try:
+            return DYNAMODB_CONTEXT.create_decimal(repr(value))
+        except DecimalException:
+            raise ValueError(f"{value} is out of the range of numbers dynamodb can store")
+    if isinstance(value, dict):
+        return {k: to_dynamodb(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_dynamodb(v) for v in value]
+    return value
+
+
+def _json_default(o):
+    """ Encodes the types boto3 reads from dynamodb that json does not know,
+        the same way pydantic does
+    """
+    if isinstance(o, Decimal):
+        return int(o) if o == o.to_integral_value() else float(o)
+    if isinstance(o, (set, frozenset)):
+        return list(o)
+    if isinstance(o, (bytes, bytearray)):
+        return o.decode()
+    value = getattr(o, 'value', None) # boto3 Binary
+    if isinstance(value, bytes):
+        return value.decode()
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+def to_json(obj) -> str:
+    """ Serializes plain python data to compact json, with orjson when it is installed
+
+    Args:
+        obj: dicts, lists and scalars, including the types boto3 reads from dynamodb
+
+    Returns:
+        str: the json text
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=_json_default).decode('utf-8')
+    return json.dumps(obj, default=_json_default, separators=(',', ':'), ensure_ascii=False)
 
 
 class Model(BaseModel):
@@ -17,11 +204,16 @@ class Model(BaseModel):
         guid (str): a generated uuid4 string
         name (str): name for this objec
         metadata (dict): dictionary for arbitrary data of the object
+        revision (str): token set by the ModelStore on every write, changes whenever the model does
+        version (int): count of the writes to the model, set by the ModelStore, a patch
+            carrying it only succeeds if the model is still at that version
 
     """
     guid: str = Field(default_factory= lambda: str(uuid4()))
     name: str = None
     metadata: dict = None
+    revision: str = None
+    version: int = None
 
     @validator('guid')
     def validate_guid(cls, g:str) -> str:
@@ -50,9 +242,9 @@ class Model(BaseModel):
             db_json (Dict): The dynamodb json format in a python dict: {key: { type: value}}
 
         Returns:
-            [type]: [description]
+            [Model]: Instance of Model
         """
-        data = json_util.loads(db_json)
+        data = {name: decode_attribute_value(value) for name, value in db_json.items()}
         return cls(**data)
          
 
@@ -82,9 +274,11 @@ class ResponseBody(BaseModel):
         Attributes:
             errors (list): of ModelErrors encounterd
             models (list): of models returned
+            next (str): (Optional) opaque cursor to request the next page of a listing
     '''
     errors: List[ModelError] = Field(default_factory=list)
     models: List[Model] = Field(default_factory=list)
+    next: Optional[str] = None
 
 class Response(BaseModel):
     ''' Response encapsulates a full response payload
@@ -103,6 +297,8 @@ class Response(BaseModel):
     isBase64Encoded: bool = False
     cookies: list = []
     body: ResponseBody = Field(default_factory=ResponseBody)
+    # fields of the models written by dump, all of them when None
+    _fields: Optional[Set[str]] = PrivateAttr(default=None)
 
     def add_model(self, model: Model):
         self.body.models.append(model)
@@ -123,40 +319,270 @@ class Response(BaseModel):
         self.statusCode = error.status
         self.body.errors.append(error)
 
+    def set_next(self, cursor: Optional[str]):
+        self.body.next = cursor
+
+    def set_fields(self, fields: Optional[Set[str]]):
+        self._fields = fields
+
+    def set_etag(self, revision: Optional[str]):
+        """ Sets the ETag header to the revision of the model returned """
+        if revision is not None:
+            self.headers = {**self.headers, "ETag": f'"{revision}"'}
+
+    def set_not_modified(self, revision: str):
+        """ Turns this into a 304 with no body, for a conditional read
+            of a model the client already holds
+        """
+        self.statusCode = 304
+        self.headers = {"ETag": f'"{revision}"'}
+        self.body = None
+
+    def _model_dict(self, model: Model) -> Dict:
+        # the __dict__ of a pydantic model holds exactly its field values
+        if self._fields is None:
+            return model.__dict__
+        return {k: v for k, v in model.__dict__.items() if k in self._fields}
+
+    def _body_json(self, models: bool = True) -> str:
+        body = self.body
+        if not body.errors and not body.models and body.next is None:
+            return _EMPTY_BODY if models else _EMPTY_SUMMARY
+        data = {'errors': [e.__dict__ for e in body.errors]}
+        if models:
+            data['models'] = [self._model_dict(m) for m in body.models]
+        data['next'] = body.next
+        return to_json(data)
+
+    def _envelope(self) -> Dict:
+        return {
+            'statusCode': self.statusCode,
+            'headers': dict(self.headers),
+            'isBase64Encoded': self.isBase64Encoded,
+            'cookies': list(self.cookies),
+            'body': ''
+        }
+
     def dump(self) -> Dict:
         '''
             This creates a properly formatted response dictionary to return
-            from a lambda handler call
+            from a lambda handler call. The models and errors are serialized
+            from their field values with to_json instead of through pydantic,
+            this is the hot path of every request.
         '''
-        me = self.dict(exclude={'body'})
-        me['body']=''
+        me = self._envelope()
         if self.body is not None:
-            me['body'] = self.body.json()
+            me['body'] = self._body_json()
+        return me
+
+    def dump_ndjson(self, lines: Iterable[str]) -> Dict:
+        '''
+            This creates a response dictionary with a newline delimited json body.
+            Each of the lines is written as it is produced, then a final line with
+            the body minus its models, which carries any errors and the next cursor
+            set on this response while the lines were produced.
+        '''
+        buf = io.StringIO()
+        for line in lines:
+            buf.write(line)
+            buf.write('\n')
+        buf.write(self._body_json(models=False))
+        me = self._envelope()
+        me['headers']["Content-Type"] = "application/x-ndjson"
+        me['body'] = buf.getvalue()
         return me
 
+_EMPTY_BODY = to_json({'errors': [], 'models': [], 'next': None})
+_EMPTY_SUMMARY = to_json({'errors': [], 'next': None})
+
+class BatchOperation(BaseModel):
+    ''' A single write in a batch request
+
+        Attributes:
+            action (str): 'put' to create or replace the model, 'delete' to remove it
+            model (Model): the model to put, for a delete only the guid is used
+    '''
+    action: Literal['put', 'delete'] = 'put'
+    model: Model
+    # the guid of the request when it is not a uuid, as Model would replace it with a new one
+    _invalid_guid: Optional[str] = PrivateAttr(default=None)
+
+    def __init__(self, **data: Any) -> None:
+        model = data.get('model', None)
+        raw = model.get('guid', None) if isinstance(model, dict) else None
+        super().__init__(**data)
+        if raw is None:
+            return
+        try:
+            UUID(str(raw))
+        except ValueError:
+            self._invalid_guid = str(raw)
+
+class BatchRequest(BaseModel):
+    ''' Body of a batch write request
+
+        Attributes:
+            operations (list): of BatchOperations to apply
+    '''
+    operations: List[BatchOperation] = Field(default_factory=list)
+
+class ModelCache():
+    """ ModelCache is a bounded in-process cache of models keyed by guid.
+        Entries expire ttl seconds after they were put and the least recently
+        used entry is evicted once max_size is reached. An expired entry is kept
+        until it is evicted, so its revision can be checked and the entry renewed. It lives as long as the
+        ModelStore that owns it, so on a warm lambda container across invocations.
+        Cached models are copies, but the instance returned by get is shared
+        between hits and must be treated as read only. It is locked so the worker
+        threads of an AsyncModelStore can share it.
+
+        Attributes:
+            max_size (int): maximum number of models held
+            ttl (float): seconds a model is served from the cache
+            hits (int): lookups answered by the cache
+            misses (int): lookups not in the cache or expired
+            evictions (int): entries dropped to make room for a new one
+            expirations (int): lookups that found an entry whose ttl ran out
+            revalidations (int): expired entries renewed because their revision was current
+    """
+    def __init__(self, max_size: int = 1024, ttl: float = 60.0, clock: Callable[[], float] = time.monotonic) -> None:
+        if max_size < 1:
+            raise ValueError(f"max_size: {max_size} must be greater than 0")
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.revalidations = 0
+        self._entries: "OrderedDict[str, Tuple[float, Model]]" = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, guid: str) -> Optional[Model]:
+        with self._lock:
+            entry = self._entries.get(guid, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires, model = entry
+            if expires <= self.clock():
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(guid)
+            self.hits += 1
+            return model
+
+    def put(self, model: Model) -> None:
+        guid = model.guid
+        copy = model.copy(deep=True)
+        with self._lock:
+            if guid in self._entries:
+                self._entries.move_to_end(guid)
+            elif len(self._entries) >= self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._entries[guid] = (self.clock() + self.ttl, copy)
+
+    def peek(self, guid: str) -> Optional[Model]:
+        """ Returns the cached model even when expired, without counting a lookup """
+        entry = self._entries.get(guid, None)
+        return entry[1] if entry is not None else None
+
+    def renew(self, guid: str) -> None:
+        """ Restarts the ttl of an entry after its revision was found to be current """
+        with self._lock:
+            entry = self._entries.get(guid, None)
+            if entry is not None:
+                self._entries[guid] = (self.clock() + self.ttl, entry[1])
+                self._entries.move_to_end(guid)
+                self.revalidations += 1
+
+    def invalidate(self, guid: str) -> None:
+        with self._lock:
+            self._entries.pop(guid, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'revalidations': self.revalidations
+        }
+
 class ModelStore():
     """ ModelStore class encapsulates the persistence layer functions 
-        for the 'Model' in a dynamodb table
+        for the 'Model' in a dynamodb table. The backend picks what holds the
+        table: 'dynamodb', or 'memory' or 'sqlite' from backends.py, which answer
+        the same table calls in process for load tests. It defaults to MODEL_STORE_BACKEND.
+
+        Attributes:
+            DEFAULT_PAGE_SIZE (int): number of models returned by get_all without a limit
+            MAX_PAGE_SIZE (int): upper bound on the limit a client may request
+            MAX_STREAM_MODELS (int): upper bound on the models written by stream_all
+            MAX_STREAM_BYTES (int): size at which stream_all stops, below the 6MB payload limit
+            METADATA_KEY (Pattern): metadata keys that may be filtered on
+            MAX_BATCH_OPERATIONS (int): upper bound on the operations in a batch_write or guids in a batch_get
+            BATCH_WRITE_SIZE (int): number of writes per BatchWriteItem call, the dynamodb maximum
+            BATCH_GET_SIZE (int): number of keys per BatchGetItem call, the dynamodb maximum
+            BATCH_MAX_RETRIES (int): retries of unprocessed items or keys before they are reported as errors
+            BATCH_BACKOFF_BASE (float): seconds of the first retry delay, doubled each retry
     """
-    def __init__(self, table_name: str = 'models', region: str= "us-east-1") -> None:
-        self.region = region
+    DEFAULT_PAGE_SIZE = 100
+    MAX_PAGE_SIZE = 1000
+    MAX_STREAM_MODELS = 100000
+    MAX_STREAM_BYTES = 5 * 1024 * 1024
+    METADATA_KEY = re.compile(r'[A-Za-z0-9_\-]+\Z')
+    MAX_BATCH_OPERATIONS = 1000
+    BATCH_WRITE_SIZE = 25
+    BATCH_GET_SIZE = 100
+    BATCH_MAX_RETRIES = 5
+    BATCH_BACKOFF_BASE = 0.05
+
+    def __init__(self, table_name: str = 'models', region: str = None, cache: ModelCache = None, name_index: str = None, backend: str = None) -> None:
+        self.region = region or aws_region
         self.table_name = table_name
+        self.cache = cache
+        self.name_index = name_index
+        self.backend = backend or storage_backend
+        self.logger =  Logger(child=True)
         self.conn=None
         self.table=None
-        try:
-            self._connect(table_name, region)
-        except:
-            pass
-        self.logger =  Logger(child=True)
-
+        # no request is made until the table is used, an error here is a misconfiguration
+        self._connect(table_name, self.region)
 
-    def _connect(self, table_name: str = 'models', region: str= "us-east-1") -> None:
-        self.conn = boto3.resource('dynamodb', region_name=region)
-        self.table = self.conn.Table(table_name)
+    def _connect(self, table_name: str = 'models', region: str = None) -> None:
+        if self.backend == 'dynamodb':
+            self.conn = dynamodb_resource(region)
+            self.table = self.conn.Table(table_name)
+            return
+        # the local backends are for load tests, keep them off the import path of the lambdas
+        from backends import local_backend
+        self.table = local_backend(self.backend, table_name, sqlite_path)
 
     def post(self, model: Model, query_params: dict) -> Response:
         response = Response()
-        item=model.dict(exclude_defaults=True)
+        error = self._name_error(model)
+        if error is not None:
+            response.add_model_error(error)
+            return response
+        self._stamp(model)
+        model.version = 1
+        try:
+            item = to_dynamodb(model.dict(exclude_defaults=True))
+        except ValueError as e:
+            response.add_model_error(ModelError(status=400, title="invalid number", detail=str(e), instance=model.guid))
+            return response
         try:
             resp = self.table.put_item(
                 Item=item,
@@ -166,75 +592,856 @@ class ModelStore():
             self.logger.error(e)
             response.add_boto_error(e)
         else:
+            self._cache_put(model)
+            response.set_etag(model.revision)
             response.add_model(model)
         return response
 
     def get(self, model: Model, query_params: dict) -> Response:
-        guid = str(model.guid)
+        return self.get_by_guid(str(model.guid), query_params)
+
+    def get_by_guid(self, guid: str, query_params: dict = None, if_none_match: Optional[Set[str]] = None) -> Response:
+        """ Reads one model, from the cache when it holds a current copy.
+            A conditional read first checks the revision alone, so a client
+            that already holds the current model gets a 304 without the item
+            being read or serialized.
+
+        Args:
+            guid (str): the guid of the model, already validated by the caller
+            query_params (dict): the query string parameters of the request
+            if_none_match (Set[str]): (Optional) revisions the client holds, '*' matches any
+
+        Returns:
+            Response: with the model or a not found error, or a 304 if the model is unchanged
+        """
         response = Response()
         try:
-            items = self.table.get_item(Key={"guid": guid})
+            fields, projection = self._projection(query_params)
+        except ValueError as e:
+            response.add_model_error(ModelError(status=400, title="invalid fields", detail=str(e)))
+            return response
+        response.set_fields(fields)
+        cached = self._cache_get(guid)
+        if cached is None:
+            cached = self._cache_revalidate(guid)
+        if cached is not None:
+            if self._matches(cached.revision, if_none_match):
+                response.set_not_modified(cached.revision)
+                return response
+            response.set_etag(cached.revision)
+            response.add_model(cached)
+            return response
+        if if_none_match:
+            try:
+                revision = self._read_revision(guid)
+            except ClientError as e:
+                self.logger.error(e.response['Error']['Message'])
+                response.add_boto_error(e)
+                return response
+            if self._matches(revision, if_none_match):
+                response.set_not_modified(revision)
+                return response
+        if fields is not None and 'revision' not in fields:
+            # the revision is read for the ETag, the response still leaves it out
+            projection = {
+                'ProjectionExpression': projection['ProjectionExpression'] + ', #rev',
+                'ExpressionAttributeNames': {**projection['ExpressionAttributeNames'], '#rev': 'revision'}
+            }
+        try:
+            items = self.table.get_item(Key={"guid": guid}, **projection)
         except ClientError as e:
             self.logger.error(e.response['Error']['Message'])
             response.add_boto_error(e)
         else:
             item = items.get('Item', None)
             if item is not None:
-                response.add_model(Model(**item))
+                model = Model(**item)
+                # a projected read is not a whole model so is not cached
+                if fields is None:
+                    self._cache_put(model)
+                response.set_etag(item.get('revision', None))
+                response.add_model(model)
             else:
                 m = ModelError(status=400, title="object not found", detail=f"Object with guid: {guid} was not found")
                 response.add_model_error(m)
         return response
 
+    @staticmethod
+    def _matches(revision: Optional[str], if_none_match: Optional[Set[str]]) -> bool:
+        if revision is None or not if_none_match:
+            return False
+        return '*' in if_none_match or revision in if_none_match
+
+    def batch_get(self, guids: List[str], query_params: dict = None, map_chunks: Callable = map) -> Response:
+        """ Reads the models for a list of guids with BatchGetItem in chunks of
+            BATCH_GET_SIZE, retrying any UnprocessedKeys with exponential backoff.
+            Models are returned in the order of the guids, each guid that is not
+            a uuid, was not found or could not be read gets an error whose instance
+            is the guid.
+
+        Args:
+            guids (List[str]): the guids of the models to read
+            query_params (dict): the query string parameters of the request
+            map_chunks (Callable): (Optional) maps the read of a chunk over the chunks,
+                in order, the builtin map reads them one after another
+
+        Returns:
+            Response: with the models found and an error for each guid that was not
+        """
+        response = Response()
+        if len(guids) > self.MAX_BATCH_OPERATIONS:
+            m = ModelError(
+                status=400,
+                title="batch too large",
+                detail=f"a batch may contain at most {self.MAX_BATCH_OPERATIONS} guids, got {len(guids)}"
+            )
+            response.add_model_error(m)
+            return response
+        try:
+            fields, projection = self._projection(query_params)
+        except ValueError as e:
+            response.add_model_error(ModelError(status=400, title="invalid fields", detail=str(e)))
+            return response
+        response.set_fields(fields)
+
+        errors: Dict[str, ModelError] = {}
+        found: Dict[str, Model] = {}
+        # guids are stored in canonical form, so are looked up by it whatever case they were given in
+        canonical: Dict[str, str] = {}
+        for guid in dict.fromkeys(guids):
+            try:
+                canonical[guid] = str(UUID(guid))
+            except ValueError:
+                errors[guid] = ModelError(status=400, title="invalid guid", detail=f"guid: {guid} is not a uuid", instance=guid)
+        keys = []
+        for guid in dict.fromkeys(canonical.values()):
+            cached = self._cache_get(guid)
+            if cached is not None:
+                found[guid] = cached
+            else:
+                keys.append({'guid': guid})
+
+        chunks = [keys[start:start + self.BATCH_GET_SIZE] for start in range(0, len(keys), self.BATCH_GET_SIZE)]
+        read = partial(self._guarded, self._batch_get_chunk, projection=projection)
+        for chunk, (result, e) in zip(chunks, map_chunks(read, chunks)):
+            if e is not None:
+                self.logger.error(e.response['Error']['Message'])
+                for key in chunk:
+                    errors[key['guid']] = ModelError(
+                        status=e.response['ResponseMetadata']['HTTPStatusCode'],
+                        title=e.response['Error']['Code'],
+                        detail=e.response['Error']['Message'],
+                        instance=key['guid']
+                    )
+                continue
+            items, unprocessed = result
+            for item in items:
+                model = Model(**item)
+                if fields is None:
+                    self._cache_put(model)
+                found[model.guid] = model
+            for key in unprocessed:
+                errors[key['guid']] = ModelError(
+                    status=503,
+                    title="unprocessed key",
+                    detail=f"Object with guid: {key['guid']} was not read after {self.BATCH_MAX_RETRIES} retries",
+                    instance=key['guid']
+                )
+
+        for guid in guids:
+            guid = canonical.get(guid, guid)
+            if guid in found:
+                response.add_model(found[guid])
+            elif guid in errors:
+                response.add_model_error(errors[guid])
+            else:
+                m = ModelError(status=400, title="object not found", detail=f"Object with guid: {guid} was not found", instance=guid)
+                response.add_model_error(m)
+        return response
+
+    @staticmethod
+    def _guarded(fn: Callable, *args, **kwargs) -> Tuple[Any, Optional[ClientError]]:
+        """ Calls fn, returning what it raises as a ClientError instead of raising it """
+        try:
+            return fn(*args, **kwargs), None
+        except ClientError as e:
+            return None, e
+
+    def _batch_get_chunk(self, keys: List[Dict], projection: Dict = None) -> Tuple[List[Dict], List[Dict]]:
+        """ Reads one chunk of keys with BatchGetItem and retries what dynamodb
+            leaves unprocessed with exponential backoff and full jitter.
+
+        Args:
+            keys (List[Dict]): the keys of the chunk
+            projection (Dict): (Optional) ProjectionExpression and ExpressionAttributeNames of the read
+
+        Raises:
+            ClientError: if a BatchGetItem call fails
+
+        Returns:
+            Tuple[List[Dict], List[Dict]]: the items read and the keys still unprocessed once the retries ran out
+        """
+        client = self.table.meta.client
+        items = []
+        pending = keys
+        for attempt in range(self.BATCH_MAX_RETRIES + 1):
+            if attempt:
+                time.sleep(random.uniform(0, self.BATCH_BACKOFF_BASE * 2 ** (attempt - 1)))
+            resp = client.batch_get_item(RequestItems={self.table_name: {'Keys': pending, **(projection or {})}})
+            items.extend(resp.get('Responses', {}).get(self.table_name, []))
+            pending = resp.get('UnprocessedKeys', {}).get(self.table_name, {}).get('Keys', [])
+            if not pending:
+                break
+        return items, pending
+
     def get_all(self, query_params: dict = None) -> Response:
-        done = False
-        start_key = None
-        models = list()
+        """ Returns a single page of models from the table. The page size is
+            taken from the 'limit' query parameter and the page start from the
+            'next' query parameter, which is the opaque cursor returned in the
+            body of the previous page. A response without a 'next' cursor is
+            the last page.
+
+        Args:
+            query_params (dict): the query string parameters of the request
+
+        Returns:
+            Response: with the models of this page and the cursor to the next
+        """
         response = Response()
-        while not done:
-            scan_kwargs = {}
+        try:
+            limit, start_key = self._page_params(query_params)
+        except ValueError as e:
+            m = ModelError(status=400, title="invalid paging parameters", detail=str(e))
+            response.add_model_error(m)
+            return response
+        try:
+            fields, projection = self._projection(query_params)
+        except ValueError as e:
+            response.add_model_error(ModelError(status=400, title="invalid fields", detail=str(e)))
+            return response
+        response.set_fields(fields)
+        try:
+            scan_kwargs = {'Limit': limit, **projection, **self._filter(query_params)}
+        except ValueError as e:
+            response.add_model_error(ModelError(status=400, title="invalid filter", detail=str(e)))
+            return response
+        if start_key:
+            scan_kwargs['ExclusiveStartKey']=start_key
+        try:
+            resp = self.table.scan(**scan_kwargs)
+        except ClientError as e:
+            self.logger.error(e.response['Error']['Message'])
+            response.add_boto_error(e)
+        else:
+            response.add_models([Model(**item) for item in resp.get('Items', [])])
+            response.set_next(self.encode_cursor(resp.get('LastEvaluatedKey', None)))
+        return response
+
+    def find_by_name(self, name: str, query_params: dict = None) -> Response:
+        """ Returns a single page of the models with a name, read with a Query
+            on the name_index global secondary index instead of a scan, so the
+            cost is proportional to the matches rather than to the table. Paging,
+            fields and the other filters work as they do for get_all. The index
+            is eventually consistent, a model written a moment ago may be missing.
+            Without a name_index the table is scanned with a filter on the name.
+
+        Args:
+            name (str): the name to look up
+            query_params (dict): the query string parameters of the request
+
+        Returns:
+            Response: with the models of this page and the cursor to the next
+        """
+        if self.name_index is None:
+            return self.get_all({**(query_params or {}), 'name': name})
+        response = Response()
+        try:
+            limit, start_key = self._page_params(query_params)
+            fields, projection = self._projection(query_params)
+            filters = self._filter({k: v for k, v in (query_params or {}).items() if k != 'name'})
+        except ValueError as e:
+            response.add_model_error(ModelError(status=400, title="invalid query parameters", detail=str(e)))
+            return response
+        response.set_fields(fields)
+        query_kwargs = {
+            'IndexName': self.name_index,
+            'KeyConditionExpression': Key('name').eq(name),
+            'Limit': limit,
+            **projection,
+            **filters
+        }
+        if start_key:
+            query_kwargs['ExclusiveStartKey']=start_key
+        try:
+            resp = self.table.query(**query_kwargs)
+        except ClientError as e:
+            self.logger.error(e.response['Error']['Message'])
+            response.add_boto_error(e)
+        else:
+            response.add_models([Model(**item) for item in resp.get('Items', [])])
+            response.set_next(self.encode_cursor(resp.get('LastEvaluatedKey', None)))
+        return response
+
+    def stream_all(self, query_params: dict, response: Response) -> Iterator[str]:
+        """ Lazily scans the table page by page and yields each model serialized
+            to a json line, so only one page of items is held at a time. The lines are
+            still gathered into a whole body by dump_ndjson, so the memory of a response
+            is bounded by MAX_STREAM_BYTES rather than by a page. Stops after 'limit'
+            models or MAX_STREAM_BYTES and sets the cursor of the last model written as
+            next on the response. Errors are added to the response.
+
+        Args:
+            query_params (dict): the query string parameters of the request
+            response (Response): collects the next cursor and any errors
+
+        Yields:
+            str: a model as a single line of json
+        """
+        try:
+            limit, start_key = self._page_params(query_params, self.MAX_STREAM_MODELS, self.MAX_STREAM_MODELS)
+        except ValueError as e:
+            m = ModelError(status=400, title="invalid paging parameters", detail=str(e))
+            response.add_model_error(m)
+            return
+        try:
+            fields, projection = self._projection(query_params)
+        except ValueError as e:
+            response.add_model_error(ModelError(status=400, title="invalid fields", detail=str(e)))
+            return
+        try:
+            scan_kwargs = {'Limit': min(limit, self.MAX_PAGE_SIZE), **projection, **self._filter(query_params)}
+        except ValueError as e:
+            response.add_model_error(ModelError(status=400, title="invalid filter", detail=str(e)))
+            return
+        count = 0
+        size = 0
+        while True:
             if start_key:
-                scan_kwargs['ExlusiveStartKey']=start_key
+                scan_kwargs['ExclusiveStartKey']=start_key
             try:
                 resp = self.table.scan(**scan_kwargs)
             except ClientError as e:
                 self.logger.error(e.response['Error']['Message'])
                 response.add_boto_error(e)
-            else:
-                for item in resp.get('Items', []):
-                    models.append(Model(**item))
+                response.set_next(self.encode_cursor(start_key))
+                return
+            items = resp.get('Items', [])
+            start_key = resp.get('LastEvaluatedKey', None)
+            for i, item in enumerate(items):
+                model = Model(**item).__dict__
+                line = to_json(model if fields is None else {k: v for k, v in model.items() if k in fields})
+                count += 1
+                size += len(line.encode('utf-8')) + 1
+                yield line
+                if count >= limit or size >= self.MAX_STREAM_BYTES:
+                    if i + 1 < len(items) or start_key is not None:
+                        response.set_next(self.encode_cursor({'guid': item['guid']}))
+                    return
+            if start_key is None:
+                return
+
+    def _filter(self, query_params: dict = None) -> Dict:
+        """ Builds a FilterExpression from the filter query parameters, which
+            are combined with and:
+            'name' the name equals the value, 'name_prefix' the name begins with
+            the value, and 'metadata.<key>' the metadata key equals the value, as a
+            string or, when the value is a number, as that number.
+            dynamodb applies a filter after reading a page, so a filtered page can
+            hold fewer models than its limit, or none, and still have a next cursor.
+
+        Args:
+            query_params (dict): the query string parameters of the request
+
+        Raises:
+            ValueError: if a metadata key is not made of letters, digits, '_' or '-'
+
+        Returns:
+            Dict: the FilterExpression argument of a scan, empty without filters
+        """
+        conditions = []
+        for param, value in (query_params or {}).items():
+            if param == 'name':
+                conditions.append(Attr('name').eq(value))
+            elif param == 'name_prefix':
+                conditions.append(Attr('name').begins_with(value))
+            elif param.startswith('metadata.'):
+                key = param[len('metadata.'):]
+                if self.METADATA_KEY.match(key) is None:
+                    raise ValueError(f"metadata key: {key} may only hold letters, digits, '_' and '-'")
+                condition = Attr(param).eq(value)
+                number = self._number(value)
+                if number is not None:
+                    # a query string holds only strings, the stored value may be either
+                    condition = condition | Attr(param).eq(number)
+                conditions.append(condition)
+        if not conditions:
+            return {}
+        condition = conditions[0]
+        for c in conditions[1:]:
+            condition = condition & c
+        return {'FilterExpression': condition}
+
+    @staticmethod
+    def _number(value: str) -> Optional[Decimal]:
+        """ The number a query string value holds as dynamodb stores it, None if it is not one """
+        try:
+            number = DYNAMODB_CONTEXT.create_decimal(value.strip())
+        except DecimalException:
+            return None
+        return number if number.is_finite() else None
+
+    def _projection(self, query_params: dict = None) -> Tuple[Optional[Set[str]], Dict]:
+        """ Turns the comma separated 'fields' query parameter into a dynamodb
+            projection, so only those attributes are read. The guid is always
+            part of it as it identifies the model and is the key of the next cursor.
+
+        Args:
+            query_params (dict): the query string parameters of the request
+
+        Raises:
+            ValueError: if a field is not a field of Model
+
+        Returns:
+            Tuple[Optional[Set[str]], Dict]: the fields and the projection arguments
+                of a read, None and no arguments when all fields are wanted
+        """
+        requested = (query_params or {}).get('fields', None)
+        if not requested:
+            return None, {}
+        fields = {f.strip() for f in requested.split(',') if f.strip()}
+        unknown = fields - set(Model.__fields__)
+        if unknown:
+            raise ValueError(f"fields: {', '.join(sorted(unknown))} are not fields of a model")
+        fields.add('guid')
+        names = {f"#f{i}": field for i, field in enumerate(sorted(fields))}
+        projection = {
+            'ProjectionExpression': ', '.join(names),
+            'ExpressionAttributeNames': names
+        }
+        return fields, projection
+
+    def _page_params(self, query_params: dict = None, default_limit: int = None, max_limit: int = None) -> Tuple[int, Optional[Dict]]:
+        """ Extracts the page size and the start key from the query params
+
+        Args:
+            query_params (dict): the query string parameters of the request
+            default_limit (int): (Optional) used when no limit is given, defaults to DEFAULT_PAGE_SIZE
+            max_limit (int): (Optional) cap on the limit, defaults to MAX_PAGE_SIZE
+
+        Raises:
+            ValueError: if limit is not a positive integer or the cursor is malformed
+
+        Returns:
+            Tuple[int, Optional[Dict]]: the page size and the decoded start key
+        """
+        query_params = query_params or {}
+        limit = query_params.get('limit', None)
+        if limit is None:
+            limit = default_limit or self.DEFAULT_PAGE_SIZE
+        else:
+            try:
+                limit = int(limit)
+            except (TypeError, ValueError):
+                raise ValueError(f"limit: {limit} is not an integer")
+            if limit < 1:
+                raise ValueError(f"limit: {limit} must be greater than 0")
+            limit = min(limit, max_limit or self.MAX_PAGE_SIZE)
+        start_key = self.decode_cursor(query_params.get('next', None))
+        return limit, start_key
+
+    def scan_parallel(self, total_segments: int = 4, max_pending_pages: int = 8, page_size: int = None) -> Iterator[Model]:
+        """ Streams every model in the table using a dynamodb parallel scan.
+            Each segment is scanned by its own worker thread, the pages they read
+            are handed over through a bounded queue so the workers block once
+            max_pending_pages are waiting on the consumer. Models are yielded in
+            no particular order. Closing the generator early stops the workers.
+
+        Args:
+            total_segments (int): number of scan segments and worker threads
+            max_pending_pages (int): pages buffered before the workers block
+            page_size (int): (Optional) Limit for each scan call of a segment
+
+        Raises:
+            ValueError: if total_segments or max_pending_pages is less than 1
+            ClientError: the first error raised by any segment scan
+
+        Yields:
+            Model: each model stored in the table
+        """
+        if total_segments < 1:
+            raise ValueError(f"total_segments: {total_segments} must be greater than 0")
+        if max_pending_pages < 1:
+            raise ValueError(f"max_pending_pages: {max_pending_pages} must be greater than 0")
+        # only bulk reads need a thread pool, keep it off the import path of the lambdas
+        from concurrent.futures import ThreadPoolExecutor
+        pages = Queue(maxsize=max_pending_pages)
+        stop = Event()
+        executor = ThreadPoolExecutor(max_workers=total_segments, thread_name_prefix="scan-segment")
+        try:
+            for segment in range(total_segments):
+                executor.submit(self._scan_segment, segment, total_segments, page_size, pages, stop)
+            remaining = total_segments
+            while remaining:
+                page = pages.get()
+                if page is None:
+                    remaining -= 1
+                elif isinstance(page, Exception):
+                    raise page
+                else:
+                    for item in page:
+                        yield Model(**item)
+        finally:
+            stop.set()
+            executor.shutdown(wait=True)
+
+    def _scan_segment(self, segment: int, total_segments: int, page_size: Optional[int], pages: Queue, stop: Event) -> None:
+        """ Worker for scan_parallel, scans one segment to the end and puts each
+            page of items on the queue followed by None, or the error raised.
+            The low level client is used as it is thread safe, unlike the table resource.
+        """
+        client = self.table.meta.client
+        scan_kwargs = {
+            'TableName': self.table_name,
+            'Segment': segment,
+            'TotalSegments': total_segments
+        }
+        if page_size:
+            scan_kwargs['Limit'] = page_size
+        try:
+            while not stop.is_set():
+                resp = client.scan(**scan_kwargs)
+                if not self._offer(pages, resp.get('Items', []), stop):
+                    return
                 start_key = resp.get('LastEvaluatedKey', None)
-                done = start_key is None
-        response.add_models(models)
-        return response
-    
-    def patch(self, model: Model, query_params: dict) -> Response:
+                if start_key is None:
+                    break
+                scan_kwargs['ExclusiveStartKey'] = start_key
+        except Exception as e:
+            self.logger.error(e)
+            self._offer(pages, e, stop)
+        self._offer(pages, None, stop)
+
+    @staticmethod
+    def _offer(pages: Queue, page, stop: Event) -> bool:
+        """ Blocking put on the queue that gives up once stop is set
+
+        Returns:
+            bool: True if the page was queued
+        """
+        while not stop.is_set():
+            try:
+                pages.put(page, timeout=0.1)
+            except Full:
+                continue
+            return True
+        return False
+
+    def _cache_get(self, guid: str) -> Optional[Model]:
+        if self.cache is None:
+            return None
+        model = self.cache.get(guid)
+        self.logger.debug({'cache': 'hit' if model is not None else 'miss', 'guid': guid})
+        return model
+
+    def _read_revision(self, guid: str) -> Optional[str]:
+        """ Reads only the revision of a model. The item is not transferred or
+            parsed, although dynamodb still bills the read on the full item size.
+
+        Raises:
+            ClientError: if the read fails
+
+        Returns:
+            str: the revision, None if the model does not exist or has none
+        """
+        resp = self.table.get_item(
+            Key={"guid": guid},
+            ProjectionExpression="#r",
+            ExpressionAttributeNames={"#r": "revision"}
+        )
+        return resp.get('Item', {}).get('revision', None)
+
+    def _cache_revalidate(self, guid: str) -> Optional[Model]:
+        """ Checks an expired cache entry against the revision stored in the table.
+
+        Returns:
+            Model: the cached model if its revision is current, else None
+        """
+        if self.cache is None:
+            return None
+        stale = self.cache.peek(guid)
+        if stale is None or stale.revision is None:
+            return None
+        try:
+            revision = self._read_revision(guid)
+        except ClientError as e:
+            self.logger.error(e.response['Error']['Message'])
+            return None
+        if revision != stale.revision:
+            self.cache.invalidate(guid)
+            return None
+        self.cache.renew(guid)
+        self.logger.debug({'cache': 'revalidated', 'guid': guid})
+        return stale
+
+    @staticmethod
+    def _stamp(model: Model) -> None:
+        """ Sets a new revision on a model about to be written """
+        model.revision = uuid4().hex
+
+    @staticmethod
+    def _name_error(model: Model) -> Optional[ModelError]:
+        """ The error for a model with an empty name, which dynamodb rejects as the key of name-index """
+        if model.name != '':
+            return None
+        return ModelError(status=400, title="invalid name", detail="name can not be empty", instance=model.guid)
+
+    def _cache_put(self, model: Model) -> None:
+        if self.cache is not None:
+            self.cache.put(model)
+
+    def _cache_invalidate(self, guid: str) -> None:
+        if self.cache is not None:
+            self.cache.invalidate(guid)
+
+    @staticmethod
+    def encode_cursor(key: Optional[Dict]) -> Optional[str]:
+        """ Encodes a dynamodb LastEvaluatedKey into an opaque url safe cursor
+
+        Args:
+            key (Dict): the LastEvaluatedKey of a scan or query
+
+        Returns:
+            str: the cursor or None if there is no key
+        """
+        if not key:
+            return None
+        raw = json.dumps(key, separators=(',', ':'), sort_keys=True)
+        return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+    @staticmethod
+    def decode_cursor(cursor: Optional[str]) -> Optional[Dict]:
+        """ Decodes a cursor created by encode_cursor back into an ExclusiveStartKey
+
+        Args:
+            cursor (str): the cursor passed in by the client
+
+        Raises:
+            ValueError: if the cursor can not be decoded
+
+        Returns:
+            Dict: the ExclusiveStartKey or None if there is no cursor
+        """
+        if not cursor:
+            return None
+        try:
+            key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        except (binascii.Error, UnicodeError, ValueError):
+            raise ValueError(f"next: {cursor} is not a valid cursor")
+        if not isinstance(key, dict):
+            raise ValueError(f"next: {cursor} is not a valid cursor")
+        return key
+
+    def patch(self, model: Model, query_params: dict, if_match: Optional[Set[str]] = None) -> Response:
+        """ Updates only the fields a patch supplies, so the write is the size of
+            the change rather than of the item. A field supplied as null is removed,
+            metadata is merged key by key and a key supplied as null is removed from it.
+            The version is incremented by the write itself, so it counts every change
+            however many writers race. A model carrying the version it was read at,
+            or an if_match of the revisions it may be at, is only written if no one
+            else has written since, otherwise a conflict error is returned.
+
+        Args:
+            model (Model): the guid and the fields to change
+            query_params (dict): the query string parameters of the request
+            if_match (Set[str]): (Optional) revisions the model must be at, '*' matches any
+
+        Returns:
+            Response: with the old and new values of the changed fields, or the error
+        """
         response = Response()
-        item=model.dict(exclude_defaults=True)
+        guid = model.guid
+        expected = model.version
+        supplied = model.__fields_set__ - {'guid', 'revision', 'version'}
+        metadata = model.metadata if 'metadata' in supplied else None
+        if metadata is not None and '' in metadata:
+            response.add_model_error(ModelError(status=400, title="invalid metadata", detail="metadata keys can not be empty"))
+            return response
+        error = self._name_error(model)
+        if error is not None:
+            response.add_model_error(error)
+            return response
         try:
-            resp = self.table.put_item(
-                Item=item,
-                ConditionExpression =Attr("guid").eq(model.guid),
-                ReturnValues = "ALL_OLD"
-            )
+            metadata = to_dynamodb(metadata)
+        except ValueError as e:
+            response.add_model_error(ModelError(status=400, title="invalid number", detail=str(e), instance=guid))
+            return response
+        self._stamp(model)
+        # a null metadata removes the map, otherwise its keys are merged
+        changes = {field: getattr(model, field) for field in supplied if field != 'metadata' or metadata is None}
+        changes['revision'] = model.revision
+        condition = Attr("guid").eq(guid)
+        if expected is not None:
+            condition = condition & Attr("version").eq(expected)
+        if if_match and '*' not in if_match:
+            condition = condition & Attr("revision").is_in(sorted(if_match))
+        try:
+            try:
+                resp = self._update(guid, changes, metadata, condition, nested=True)
+            except ClientError as e:
+                # a key can only be set in a map that exists, the first one is written whole
+                if not metadata or e.response['Error']['Code'] != 'ValidationException':
+                    raise
+                try:
+                    resp = self._update(guid, changes, metadata, condition & Attr("metadata").not_exists(), nested=False)
+                except ClientError as e:
+                    # another writer may have made the map since, or the model is in conflict,
+                    # the nested write tells which
+                    if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                        raise
+                    resp = self._update(guid, changes, metadata, condition, nested=True)
         except ClientError as e:
             self.logger.error(e)
-            response.add_boto_error(e)
-        else:
-            attr = resp.get("Attributes", None)
-            if attr:
-                old_model = Model(**attr)
-                response.add_model(old_model)        
-            response.add_model(model)
+            self._cache_invalidate(guid)
+            conflict = None
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                conflict = self._conflict(guid, expected, if_match)
+            if conflict is not None:
+                response.add_model_error(conflict)
+            else:
+                response.add_boto_error(e)
+            return response
+        old_model = Model(**{**resp.get("Attributes", {}), 'guid': guid})
+        new_model = Model(guid=guid, **{field: value for field, value in changes.items() if value is not None})
+        new_model.version = (old_model.version or 0) + 1
+        if metadata is not None:
+            new_model.metadata = {key: value for key, value in metadata.items() if value is not None}
+        self._cache_patch(old_model, new_model, changes, metadata)
+        # both models hold only what the patch changed
+        response.set_fields({'guid', 'version', *changes, *(['metadata'] if metadata is not None else [])})
+        response.set_etag(new_model.revision)
+        response.add_models([old_model, new_model])
         return response
 
+    def _update(self, guid: str, changes: Dict[str, Any], metadata: Optional[Dict], condition: Any, nested: bool) -> Dict:
+        """ Writes a patch with an UpdateExpression of only the changed attributes
+
+        Args:
+            guid (str): the guid of the model
+            changes (Dict[str, Any]): the fields to set, or to remove when None
+            metadata (Dict): (Optional) the metadata keys to set, or to remove when None
+            condition: the ConditionExpression of the write
+            nested (bool): set the keys of metadata by their path, or else write the map whole
+
+        Raises:
+            ClientError: if the write fails
+
+        Returns:
+            Dict: the update_item response, with the old values of the changed attributes
+        """
+        names = {"#version": "version"}
+        values = {":one": 1}
+        sets, removes = [], []
+        for field, value in changes.items():
+            names[f"#{field}"] = field
+            if value is None:
+                removes.append(f"#{field}")
+            else:
+                values[f":{field}"] = value
+                sets.append(f"#{field} = :{field}")
+        if metadata:
+            names["#metadata"] = "metadata"
+            if nested:
+                for i, (key, value) in enumerate(metadata.items()):
+                    names[f"#m{i}"] = key
+                    if value is None:
+                        removes.append(f"#metadata.#m{i}")
+                    else:
+                        values[f":m{i}"] = value
+                        sets.append(f"#metadata.#m{i} = :m{i}")
+            else:
+                values[":metadata"] = {key: value for key, value in metadata.items() if value is not None}
+                sets.append("#metadata = :metadata")
+        update = "SET " + ", ".join(sets)
+        if removes:
+            update += " REMOVE " + ", ".join(removes)
+        update += " ADD #version :one"
+        return self.table.update_item(
+            Key={"guid": guid},
+            UpdateExpression=update,
+            ConditionExpression=condition,
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values,
+            ReturnValues="UPDATED_OLD"
+        )
+
+    def _cache_patch(self, old_model: Model, new_model: Model, changes: Dict[str, Any], metadata: Optional[Dict]) -> None:
+        """ Applies a patch to the cached copy of a model, if that copy was the
+            revision the patch replaced, otherwise drops it as it is out of date
+        """
+        if self.cache is None:
+            return
+        cached = self.cache.peek(old_model.guid)
+        if cached is None or cached.revision is None or cached.revision != old_model.revision:
+            self.cache.invalidate(old_model.guid)
+            return
+        cached = cached.copy()
+        for field, value in changes.items():
+            setattr(cached, field, value)
+        if metadata is not None:
+            merged = dict(cached.metadata or {})
+            for key, value in metadata.items():
+                if value is None:
+                    merged.pop(key, None)
+                else:
+                    merged[key] = value
+            cached.metadata = merged
+        cached.version = new_model.version
+        self.cache.put(cached)
+
+    def _conflict(self, guid: str, expected: Optional[int], if_match: Optional[Set[str]]) -> Optional[ModelError]:
+        """ Tells why a conditional patch failed. Only called once a write has
+            failed, so the common path costs no extra read.
+
+        Returns:
+            ModelError: the conflict, None if the model does not exist or the patch had no precondition that failed
+        """
+        try:
+            item = self.table.get_item(
+                Key={"guid": guid},
+                ProjectionExpression="#v, #r",
+                ExpressionAttributeNames={"#v": "version", "#r": "revision"}
+            ).get('Item', None)
+        except ClientError as e:
+            self.logger.error(e.response['Error']['Message'])
+            return None
+        if item is None:
+            return None
+        version = item.get('version', None)
+        if expected is not None and version != expected:
+            return ModelError(
+                status=409,
+                title="version conflict",
+                detail=f"Object with guid: {guid} is at version {version}, not {expected}"
+            )
+        if not if_match or '*' in if_match:
+            return None
+        return ModelError(
+            status=412,
+            title="precondition failed",
+            detail=f"Object with guid: {guid} is at revision {item.get('revision', None)}, which If-Match does not list"
+        )
+
     def delete(self, model: Model, query_params: dict) -> Response:
+        return self.delete_by_guid(model.guid, query_params)
+
+    def delete_by_guid(self, guid: str, query_params: dict = None) -> Response:
         response = Response()
-        key = { 'guid' : model.guid }
+        key = { 'guid' : guid }
+        self._cache_invalidate(guid)
         try:
             resp = self.table.delete_item(
                 Key=key,
-                ConditionExpression =Attr("guid").eq(model.guid),
+                ConditionExpression =Attr("guid").eq(guid),
                 ReturnValues="ALL_OLD"
             )
         except ClientError as e:
@@ -247,6 +1454,232 @@ class ModelStore():
                 response.add_model(model)
         return response
 
+    def batch_write(self, batch: BatchRequest, query_params: dict = None, map_chunks: Callable = map) -> Response:
+        """ Applies the operations of a batch with BatchWriteItem in chunks of
+            BATCH_WRITE_SIZE, retrying any UnprocessedItems with exponential backoff.
+            Puts replace the whole item and deletes are unconditional, as BatchWriteItem
+            does not support condition expressions. Results are reported per operation
+            in request order: the model for a success, or an error whose instance is
+            the guid of the failed operation.
+
+        Args:
+            batch (BatchRequest): the operations to apply
+            query_params (dict): the query string parameters of the request
+            map_chunks (Callable): (Optional) maps the write of a chunk over the chunks,
+                in order, the builtin map writes them one after another
+
+        Returns:
+            Response: with a model or an error for each operation
+        """
+        response = Response()
+        if len(batch.operations) > self.MAX_BATCH_OPERATIONS:
+            m = ModelError(
+                status=400,
+                title="batch too large",
+                detail=f"a batch may contain at most {self.MAX_BATCH_OPERATIONS} operations, got {len(batch.operations)}"
+            )
+            response.add_model_error(m)
+            return response
+
+        # dynamodb rejects a whole BatchWriteItem with duplicate keys, so these are not written
+        errors: Dict[str, ModelError] = {}
+        counts = Counter(op.model.guid for op in batch.operations)
+        unique = []
+        for op in batch.operations:
+            guid = op.model.guid
+            if op._invalid_guid is not None:
+                # keyed by the guid Model made up for it, which no other operation has
+                errors[guid] = ModelError(
+                    status=400,
+                    title="invalid guid",
+                    detail=f"guid: {op._invalid_guid} is not a uuid",
+                    instance=op._invalid_guid
+                )
+            elif op.action == 'put' and op.model.name == '':
+                errors[guid] = self._name_error(op.model)
+            elif counts[guid] > 1:
+                errors[guid] = ModelError(
+                    status=400,
+                    title="duplicate guid in batch",
+                    detail=f"Object with guid: {guid} appears more than once in the batch",
+                    instance=guid
+                )
+            else:
+                try:
+                    request = self._write_request(op)
+                except ValueError as e:
+                    errors[guid] = ModelError(status=400, title="invalid number", detail=str(e), instance=guid)
+                    continue
+                self._cache_invalidate(guid)
+                unique.append((guid, request))
+
+        chunks = [unique[start:start + self.BATCH_WRITE_SIZE] for start in range(0, len(unique), self.BATCH_WRITE_SIZE)]
+        write = partial(self._guarded, self._batch_write_chunk)
+        for chunk, (unprocessed, e) in zip(chunks, map_chunks(write, [[request for _, request in chunk] for chunk in chunks])):
+            if e is not None:
+                self.logger.error(e.response['Error']['Message'])
+                for guid, _ in chunk:
+                    errors[guid] = ModelError(
+                        status=e.response['ResponseMetadata']['HTTPStatusCode'],
+                        title=e.response['Error']['Code'],
+                        detail=e.response['Error']['Message'],
+                        instance=guid
+                    )
+                continue
+            for request in unprocessed:
+                guid = self._request_guid(request)
+                errors[guid] = ModelError(
+                    status=503,
+                    title="unprocessed item",
+                    detail=f"Object with guid: {guid} was not written after {self.BATCH_MAX_RETRIES} retries",
+                    instance=guid
+                )
+
+        for op in batch.operations:
+            error = errors.get(op.model.guid, None)
+            if error is not None:
+                response.add_model_error(error)
+            else:
+                response.add_model(op.model)
+        return response
+
+    def _write_request(self, op: BatchOperation) -> Dict:
+        """ The BatchWriteItem request of an operation
+
+        Raises:
+            ValueError: if the model of a put holds a number dynamodb can not store
+        """
+        if op.action == 'delete':
+            return {'DeleteRequest': {'Key': {'guid': op.model.guid}}}
+        # a put replaces the model, so its version starts again as a create's does, whatever the client sent
+        self._stamp(op.model)
+        op.model.version = 1
+        return {'PutRequest': {'Item': to_dynamodb(op.model.dict(exclude_defaults=True))}}
+
+    @staticmethod
+    def _request_guid(request: Dict) -> str:
+        if 'DeleteRequest' in request:
+            return request['DeleteRequest']['Key']['guid']
+        return request['PutRequest']['Item']['guid']
+
+    def _batch_write_chunk(self, requests: List[Dict]) -> List[Dict]:
+        """ Writes one chunk with BatchWriteItem and retries what dynamodb
+            leaves unprocessed with exponential backoff and full jitter.
+
+        Args:
+            requests (List[Dict]): the PutRequest/DeleteRequest entries of the chunk
+
+        Raises:
+            ClientError: if a BatchWriteItem call fails
+
+        Returns:
+            List[Dict]: the requests still unprocessed once the retries ran out
+        """
+        client = self.table.meta.client
+        pending = requests
+        for attempt in range(self.BATCH_MAX_RETRIES + 1):
+            if attempt:
+                time.sleep(random.uniform(0, self.BATCH_BACKOFF_BASE * 2 ** (attempt - 1)))
+            resp = client.batch_write_item(RequestItems={self.table_name: pending})
+            pending = resp.get('UnprocessedItems', {}).get(self.table_name, [])
+            if not pending:
+                break
+        return pending
+
+class AsyncModelStore():
+    """ AsyncModelStore lets asyncio code await the calls of a ModelStore
+        concurrently. boto3 has no asyncio transport, so each call runs on one of
+        max_concurrency worker threads, which bounds the requests in flight. Each
+        worker has its own ModelStore, as the table resource is not thread safe,
+        sharing the table, cache and aws session of the store it was made from.
+        The chunks of batch reads and writes are spread over the workers too.
+
+        Attributes:
+            store (ModelStore): the store the workers are made from
+            max_concurrency (int): the number of worker threads, defaults to BOTO_MAX_POOL_CONNECTIONS
+                so no worker waits on a connection
+            publisher (ModelEventPublisher): (Optional) publishes events alongside the writes
+    """
+    def __init__(self, store: ModelStore, max_concurrency: int = None, publisher: "ModelEventPublisher" = None) -> None:
+        if max_concurrency is None:
+            max_concurrency = boto_max_pool_connections
+        if max_concurrency < 1:
+            raise ValueError(f"max_concurrency: {max_concurrency} must be greater than 0")
+        # only concurrent callers need a thread pool, keep it off the import path of the lambdas
+        from concurrent.futures import ThreadPoolExecutor
+        self.store = store
+        self.max_concurrency = max_concurrency
+        self.publisher = publisher
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="model-store")
+        self._workers = local()
+        self._lock = Lock()
+
+    def _worker(self) -> ModelStore:
+        """ The ModelStore of the calling worker thread, made on its first call """
+        store = getattr(self._workers, 'store', None)
+        if store is None:
+            # making a resource from the shared session is not thread safe
+            with self._lock:
+                store = ModelStore(self.store.table_name, self.store.region, self.store.cache, self.store.name_index, self.store.backend)
+            self._workers.store = store
+        return store
+
+    async def _run(self, fn: Callable, *args, **kwargs) -> Any:
+        import asyncio
+        return await asyncio.get_running_loop().run_in_executor(self._pool, partial(fn, *args, **kwargs))
+
+    async def call(self, method: str, *args, **kwargs) -> Any:
+        """ Awaits a method of ModelStore, run by a worker with its own store """
+        return await self._run(lambda: getattr(self._worker(), method)(*args, **kwargs))
+
+    async def _fan_out(self, fn: Callable, *args) -> Response:
+        """ Runs a batch method of the store with its chunks mapped over the workers.
+            The method itself only splits and merges, it runs on the default executor
+            of the loop, as waiting on the workers from a worker could deadlock the pool.
+        """
+        import asyncio
+        return await asyncio.get_running_loop().run_in_executor(None, partial(fn, *args, map_chunks=self._pool.map))
+
+    async def get_by_guid(self, guid: str, query_params: dict = None, if_none_match: Optional[Set[str]] = None) -> Response:
+        return await self.call('get_by_guid', guid, query_params, if_none_match)
+
+    async def get_all(self, query_params: dict = None) -> Response:
+        return await self.call('get_all', query_params)
+
+    async def find_by_name(self, name: str, query_params: dict = None) -> Response:
+        return await self.call('find_by_name', name, query_params)
+
+    async def post(self, model: Model, query_params: dict = None) -> Response:
+        return await self.call('post', model, query_params)
+
+    async def patch(self, model: Model, query_params: dict = None, if_match: Optional[Set[str]] = None) -> Response:
+        return await self.call('patch', model, query_params, if_match)
+
+    async def delete_by_guid(self, guid: str, query_params: dict = None) -> Response:
+        return await self.call('delete_by_guid', guid, query_params)
+
+    async def batch_get(self, guids: List[str], query_params: dict = None) -> Response:
+        """ As ModelStore.batch_get, with the chunks read concurrently """
+        return await self._fan_out(self.store.batch_get, guids, query_params)
+
+    async def batch_write(self, batch: BatchRequest, query_params: dict = None) -> Response:
+        """ As ModelStore.batch_write, with the chunks written concurrently """
+        return await self._fan_out(self.store.batch_write, batch, query_params)
+
+    async def publish(self, events: List["ModelChangeEvent"]) -> List[Optional[ModelError]]:
+        """ Publishes events with the publisher, so a write and its events can be awaited together
+
+        Raises:
+            ValueError: if the store has no publisher
+        """
+        if self.publisher is None:
+            raise ValueError("the store has no publisher")
+        return await self._run(self.publisher.publish, events)
+
+    def close(self) -> None:
+        """ Waits for the calls in flight and stops the workers """
+        self._pool.shutdown(wait=True)
+
 class ModelEventDetail(BaseModel):
     """ ModelEventDetail class is a data structure consumed by 
         ModelChangeEvent. When serialized it comprises the 
@@ -257,11 +1690,14 @@ class ModelEventDetail(BaseModel):
             event_type (str): unique identifier for event
             old_model: (Model): (Optional) may be present if a change or deletion has occured
             new_model: (Model): (Optional) may be present if a change or creation has occured
+            revision: (str): (Optional) revision of the model after the change, None once deleted.
+                Consumers caching models can drop any copy whose revision differs.
     """
     model_id: str = ""
     event_type: str = ""
     old_model: Optional[Model] = None
     new_model: Optional[Model] = None
+    revision: Optional[str] = None
 
 
 class ModelChangeEvent(BaseModel):
@@ -307,7 +1743,7 @@ class ModelChangeEvent(BaseModel):
         return me
 
     @classmethod
-    def from_dynamodb_record(cls, event_type: str, record: DynamoDBStreamRecordModel):
+    def from_dynamodb_record(cls, event_type: str, record: "DynamoDBStreamRecordModel"):
         """ Factory classmethod to generate a well-formed ModelChangeEvent 
             from an incoming dynamodb stream event.
 
@@ -327,17 +1763,145 @@ class ModelChangeEvent(BaseModel):
         if record.dynamodb.NewImage is not None:
             new_model = Model.from_dbstream_image(record.dynamodb.NewImage)
 
-        model_id = json_util.loads(record.dynamodb.Keys)['guid']
+        model_id = decode_attribute_value(record.dynamodb.Keys['guid'])
 
         evtd = ModelEventDetail(
             event_type = event_type,
             old_model = old_model,
             new_model = new_model,
-            model_id = model_id
+            model_id = model_id,
+            revision = new_model.revision if new_model is not None else None
         )
         evt = cls(
             Source ="model.api.events",
             DetailType = f"model.change.{event_type.lower()}",
             Detail = evtd
         )
-        return evt  
\ No newline at end of file
+        return evt
+
+
+class ModelEventPublisher():
+    """ ModelEventPublisher puts ModelChangeEvents to eventbridge in as few
+        PutEvents calls as possible. Events are packed in order into calls of
+        at most MAX_ENTRIES entries and MAX_BATCH_BYTES, and only the entries
+        eventbridge reports as failed are retried, with exponential backoff.
+
+        Attributes:
+            MAX_ENTRIES (int): entries per PutEvents call, the eventbridge maximum
+            MAX_BATCH_BYTES (int): size of the entries of one call, the eventbridge maximum
+            MAX_RETRIES (int): retries of failed entries before they are reported
+            BACKOFF_BASE (float): seconds of the first retry delay, doubled each retry
+    """
+    MAX_ENTRIES = 10
+    MAX_BATCH_BYTES = 256 * 1024
+    MAX_RETRIES = 3
+    BACKOFF_BASE = 0.05
+
+    def __init__(self, eventbridge: boto3.client) -> None:
+        self.eventbridge = eventbridge
+        self.logger = Logger(child=True)
+
+    def publish(self, events: List[ModelChangeEvent]) -> List[Optional[ModelError]]:
+        """ Puts all the events to eventbridge
+
+        Args:
+            events (List[ModelChangeEvent]): the events to put, in order
+
+        Returns:
+            List[Optional[ModelError]]: for each event None if it was put, else the error
+        """
+        results: List[Optional[ModelError]] = [None] * len(events)
+        batch: List[Tuple[int, Dict]] = []
+        batch_size = 0
+        for i, event in enumerate(events):
+            entry = event.dump()
+            size = self.entry_size(entry)
+            if size > self.MAX_BATCH_BYTES:
+                results[i] = ModelError(
+                    status=400,
+                    title="event too large",
+                    detail=f"event of {size} bytes is larger than the {self.MAX_BATCH_BYTES} byte limit",
+                    instance=event.Detail.model_id
+                )
+                continue
+            if len(batch) == self.MAX_ENTRIES or batch_size + size > self.MAX_BATCH_BYTES:
+                self._put(batch, events, results)
+                batch, batch_size = [], 0
+            batch.append((i, entry))
+            batch_size += size
+        if batch:
+            self._put(batch, events, results)
+        return results
+
+    def _put(self, batch: List[Tuple[int, Dict]], events: List[ModelChangeEvent], results: List[Optional[ModelError]]) -> None:
+        """ Puts one batch of entries, retrying the failed entries and
+            recording an error in results for those that never succeed.
+        """
+        pending = batch
+        failures: Dict[int, Dict] = {}
+        for attempt in range(self.MAX_RETRIES + 1):
+            if attempt:
+                time.sleep(random.uniform(0, self.BACKOFF_BASE * 2 ** (attempt - 1)))
+            try:
+                resp = self.eventbridge.put_events(Entries=[entry for _, entry in pending])
+            except ClientError as e:
+                self.logger.error(e.response['Error']['Message'])
+                for i, _ in pending:
+                    results[i] = ModelError(
+                        status=e.response['ResponseMetadata']['HTTPStatusCode'],
+                        title=e.response['Error']['Code'],
+                        detail=e.response['Error']['Message'],
+                        instance=events[i].Detail.model_id
+                    )
+                return
+            except BotoCoreError as e:
+                # the request never got a response, such as a connection or read timeout
+                self.logger.error(e)
+                for i, _ in pending:
+                    results[i] = ModelError(
+                        status=500,
+                        title=type(e).__name__,
+                        detail=str(e),
+                        instance=events[i].Detail.model_id
+                    )
+                return
+            if not resp.get('FailedEntryCount', 0):
+                return
+            # result entries are in the same order as the request entries
+            retry = []
+            for (i, entry), result in zip(pending, resp.get('Entries', [])):
+                if result.get('ErrorCode', None):
+                    failures[i] = result
+                    retry.append((i, entry))
+            pending = retry
+            if not pending:
+                return
+        for i, _ in pending:
+            result = failures[i]
+            self.logger.error(result)
+            results[i] = ModelError(
+                status=500,
+                title=result['ErrorCode'],
+                detail=result.get('ErrorMessage', ''),
+                instance=events[i].Detail.model_id
+            )
+
+    @staticmethod
+    def entry_size(entry: Dict) -> int:
+        """ Size of a PutEvents entry as eventbridge calculates it against its limit
+
+        Args:
+            entry (Dict): a dumped ModelChangeEvent
+
+        Returns:
+            int: the size in bytes
+        """
+        size = 0
+        if entry.get('Time', None) is not None:
+            size += 14
+        for field in ('Source', 'DetailType', 'Detail', 'EventBusName'):
+            if entry.get(field, None):
+                size += len(entry[field].encode('utf-8'))
+        for resource in entry.get('Resources', None) or []:
+            size += len(resource.encode('utf-8'))
+        return size
@@ -1,4 +1,4 @@
-import sys,json
+import sys,json,uuid
 
 # need to patch path due to the way lambdas handle imports
 libdir = f"{sys.path[0]}/src"
@@ -52,7 +52,17 @@ def get_known_metadata(id=0) -> dict:
     m = get_model_set()[id]
     return m['metadata']
 
-def api_gateway_event_v2(payload: dict, path: str="", method: str="") -> dict:
+def api_gateway_event_v2(payload: dict, path: str="", method: str="", query: dict=None, headers: dict=None) -> dict:
+    if headers is None:
+        headers = {
+            "Header1": "value1",
+            "Header2": "value1,value2"
+        }
+    if query is None:
+        query = {
+            "parameter1": "value1,value2",
+            "parameter2": "value"
+        }
     return {
         "version": "2.0",
         "routeKey": "$default",
@@ -62,14 +72,8 @@ def api_gateway_event_v2(payload: dict, path: str="", method: str="") -> dict:
             "cookie1",
             "cookie2"
         ],
-        "headers": {
-            "Header1": "value1",
-            "Header2": "value1,value2"
-        },
-        "queryStringParameters": {
-            "parameter1": "value1,value2",
-            "parameter2": "value"
-        },
+        "headers": headers,
+        "queryStringParameters": query,
         "requestContext": {
             "accountId": "123456789012",
             "apiId": "api-id",
@@ -112,7 +116,7 @@ def api_gateway_event_v2(payload: dict, path: str="", method: str="") -> dict:
             "time": "12/Mar/2020:19:03:58 +0000",
             "timeEpoch": 1583348638390
         },
-        "body": json.dumps(payload),
+        "body": json.dumps(payload) if payload is not None else None,
         "pathParameters": {
             "parameter1": "value1"
         },
@@ -152,4 +156,19 @@ def get_dynamodb_stream_event():
       "eventSource": "aws:dynamodb"
     }
   ]
-}
\ No newline at end of file
+}
+
+def get_dynamodb_stream_records(count: int, first_sequence: int = 100) -> list:
+    """ copies of the record of get_dynamodb_stream_event, each for a new guid,
+        with sequence numbers counting up from first_sequence
+    """
+    template = get_dynamodb_stream_event()['Records'][0]
+    records = []
+    for i in range(count):
+        record = json.loads(json.dumps(template))
+        guid = str(uuid.uuid4())
+        record['dynamodb']['Keys']['guid']['S'] = guid
+        record['dynamodb']['NewImage']['guid']['S'] = guid
+        record['dynamodb']['SequenceNumber'] = str(first_sequence + i)
+        records.append(record)
+    return records
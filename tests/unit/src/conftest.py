@@ -16,8 +16,10 @@ def aws_credentials():
 
 @pytest.fixture(scope="module")
 def ddb(aws_credentials):
+    from src.models import aws_region
+    # the table must be in the region the model store connects to
     with mock_dynamodb2():
-        yield boto3.resource('dynamodb', region_name="us-east-1")
+        yield boto3.resource('dynamodb', region_name=aws_region)
 
 @pytest.fixture(scope="module")
 def ddb_table(ddb):
@@ -35,6 +37,28 @@ def ddb_table(ddb):
                 'AttributeName': 'guid',
                 'AttributeType': 'S'
             },
+            {
+                'AttributeName': 'name',
+                'AttributeType': 'S'
+            },
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                'IndexName': 'name-index',
+                'KeySchema': [
+                    {
+                        'AttributeName': 'name',
+                        'KeyType': 'HASH'
+                    }
+                ],
+                'Projection': {
+                    'ProjectionType': 'ALL'
+                },
+                'ProvisionedThroughput': {
+                    'ReadCapacityUnits': 1,
+                    'WriteCapacityUnits': 1
+                }
+            }
         ],
         ProvisionedThroughput={
             'ReadCapacityUnits': 1,
@@ -51,8 +75,8 @@ def ddb_table(ddb):
 
 @pytest.fixture(scope="module")
 def models_store(ddb_table):
-    from src.models import ModelStore
-    modelstore = ModelStore()
+    from src.models import ModelStore, aws_region
+    modelstore = ModelStore(region=aws_region, name_index='name-index')
     yield modelstore
 
 @pytest.fixture(scope="module")
@@ -20,6 +20,61 @@ def test_api_handler_get_known(models_store, lambda_context):
     assert model['guid'] == guid
     assert model['name'] == name
 
+def test_api_handler_get_known_path(models_store, lambda_context):
+    from src import api
+    api.model_store = models_store
+    guid = get_known_id(2)
+    event = api_gateway_event_v2(payload=None, path=f"/api/models/{guid}", method="GET")
+    response = api.router(event, lambda_context)
+    body = json.loads(response['body'])
+    assert len(body['errors']) == 0
+    assert body['models'][0]['name'] == get_known_name(2)
+    event = api_gateway_event_v2(payload=None, path=f"/api/models/{guid}/metadata", method="GET")
+    response = api.router(event, lambda_context)
+    body = json.loads(response['body'])
+    assert body['models'][0]['metadata'] == get_known_metadata(2)
+    assert 'name' not in body['models'][0]
+
+def test_api_handler_get_not_modified(models_store, lambda_context):
+    from src import api
+    api.model_store = models_store
+    event = api_gateway_event_v2(payload={'name': 'etag'}, path="/api/models", method="POST")
+    response = api.router(event, lambda_context)
+    etag = response['headers']['ETag']
+    guid = json.loads(response['body'])['models'][0]['guid']
+    event = api_gateway_event_v2(payload=None, path=f"/api/models/{guid}", method="GET")
+    response = api.router(event, lambda_context)
+    assert response['headers']['ETag'] == etag
+    headers = {'if-none-match': f'"stale", W/{etag}'}
+    for path in (f"/api/models/{guid}", f"/api/models/{guid}/metadata"):
+        event = api_gateway_event_v2(payload=None, path=path, method="GET", headers=headers)
+        response = api.router(event, lambda_context)
+        assert response['statusCode'] == 304
+        assert response['body'] == ''
+        assert response['headers'] == {'ETag': etag}
+    event = api_gateway_event_v2(payload=None, path=f"/api/models/{guid}", method="GET", headers={'if-none-match': '"stale"'})
+    response = api.router(event, lambda_context)
+    assert response['statusCode'] == 200
+    assert json.loads(response['body'])['models'][0]['name'] == 'etag'
+    models_store.delete_by_guid(guid)
+
+def test_api_handler_unknown_routes(models_store, lambda_context):
+    from src import api
+    api.model_store = models_store
+    event = api_gateway_event_v2(payload=None, path="/api/notmodels", method="GET")
+    response = api.router(event, lambda_context)
+    assert response['statusCode'] == 404
+    event = api_gateway_event_v2(payload=None, path="/api/models/not-a-guid", method="GET")
+    response = api.router(event, lambda_context)
+    assert response['statusCode'] == 400
+    event = api_gateway_event_v2(payload={'guid': 'not-a-guid'}, path="/api/models", method="GET")
+    response = api.router(event, lambda_context)
+    assert response['statusCode'] == 400
+    event = api_gateway_event_v2(payload=None, path="/api/models", method="PUT")
+    response = api.router(event, lambda_context)
+    assert response['statusCode'] == 405
+    assert response['headers']['Allow'] == "DELETE, GET, PATCH, POST"
+
 def test_api_handler_get_unknown(models_store, lambda_context):
     from src import api
     api.model_store = models_store
@@ -42,6 +97,97 @@ def test_api_handler_get_all(models_store, lambda_context):
     assert len(body['errors']) == 0
     assert len(body['models']) == 3
 
+def test_api_handler_get_all_paged(models_store, lambda_context):
+    from src import api
+    api.model_store = models_store
+    event = api_gateway_event_v2(payload={}, path="models", method="GET", query={'limit': '2'})
+    response = api.router(event, lambda_context)
+    body = json.loads(response['body'])
+    assert len(body['models']) == 2
+    assert body['next'] is not None
+    event = api_gateway_event_v2(payload={}, path="models", method="GET", query={'limit': '2', 'next': body['next']})
+    response = api.router(event, lambda_context)
+    body = json.loads(response['body'])
+    assert len(body['errors']) == 0
+    assert len(body['models']) == 1
+    assert body['next'] is None
+
+def test_api_handler_get_many(models_store, lambda_context):
+    from src import api
+    api.model_store = models_store
+    guids = [get_known_id(1), get_known_id(0)]
+    event = api_gateway_event_v2(payload={}, path="models", method="GET", query={'guids': ','.join(guids)})
+    response = api.router(event, lambda_context)
+    body = json.loads(response['body'])
+    assert len(body['errors']) == 0
+    assert [m['guid'] for m in body['models']] == guids
+
+def test_api_async_router(models_store, lambda_context):
+    from src import api
+    api.model_store = models_store
+    guids = [get_known_id(1), get_known_id(0)]
+    event = api_gateway_event_v2(payload=None, path="models", method="GET", query={'guids': ','.join(guids)})
+    body = json.loads(api.async_router(event, lambda_context)['body'])
+    assert [m['guid'] for m in body['models']] == guids
+    event = api_gateway_event_v2(payload=None, path=f"/api/models/{guids[0]}", method="GET")
+    body = json.loads(api.async_router(event, lambda_context)['body'])
+    assert body['models'][0]['name'] == get_known_name(1)
+    event = api_gateway_event_v2(payload=None, path="/api/nowhere", method="GET")
+    assert api.async_router(event, lambda_context)['statusCode'] == 404
+
+def test_api_handler_get_all_fields(models_store, lambda_context):
+    from src import api
+    api.model_store = models_store
+    event = api_gateway_event_v2(payload=None, path="models", method="GET", query={'fields': 'name'})
+    response = api.router(event, lambda_context)
+    body = json.loads(response['body'])
+    assert len(body['models']) == 3
+    assert all(set(m) == {'guid', 'name'} for m in body['models'])
+    event = api_gateway_event_v2(payload=None, path="models", method="GET", query={'fields': 'name,secret'})
+    response = api.router(event, lambda_context)
+    assert response['statusCode'] == 400
+
+def test_api_handler_get_by_name(models_store, lambda_context):
+    from src import api
+    api.model_store = models_store
+    event = api_gateway_event_v2(payload=None, path="models", method="GET", query={'name': get_known_name(1), 'limit': '1'})
+    response = api.router(event, lambda_context)
+    body = json.loads(response['body'])
+    assert len(body['errors']) == 0
+    assert [m['guid'] for m in body['models']] == [get_known_id(1)]
+
+def test_api_handler_get_all_compressed(models_store, lambda_context, monkeypatch):
+    import gzip, base64
+    from src import api
+    api.model_store = models_store
+    monkeypatch.setattr(api, 'compression_min_bytes', 1)
+    headers = {'accept-encoding': 'br;q=1.0, gzip;q=0.8, deflate;q=0.5'}
+    event = api_gateway_event_v2(payload=None, path="models", method="GET", headers=headers)
+    response = api.router(event, lambda_context)
+    assert response['isBase64Encoded'] is True
+    assert response['headers']['Content-Encoding'] == 'gzip'
+    body = json.loads(gzip.decompress(base64.b64decode(response['body'])))
+    assert len(body['models']) == 3
+    event = api_gateway_event_v2(payload=None, path="models", method="GET", headers={'accept-encoding': 'gzip;q=0'})
+    response = api.router(event, lambda_context)
+    assert response['isBase64Encoded'] is False
+    assert 'Content-Encoding' not in response['headers']
+    assert api.accepted_coding('*') == 'gzip'
+    assert api.accepted_coding('deflate, gzip;q=0') == 'deflate'
+
+def test_api_handler_get_all_ndjson(models_store, lambda_context):
+    from src import api
+    api.model_store = models_store
+    event = api_gateway_event_v2(payload={}, path="models", method="GET", query={'format': 'ndjson'})
+    response = api.router(event, lambda_context)
+    assert response['headers']['Content-Type'] == "application/x-ndjson"
+    lines = response['body'].split('\n')
+    assert len(lines) == 4
+    assert json.loads(lines[0])['guid'] == get_known_id(0)
+    summary = json.loads(lines[-1])
+    assert summary['errors'] == []
+    assert summary['next'] is None
+
 def test_api_handler_patch_known(models_store, lambda_context):
     from src import api
     api.model_store = models_store
@@ -59,6 +205,38 @@ def test_api_handler_patch_known(models_store, lambda_context):
     print (f"old: {old_name} vs new: {new_name}")
     assert  old_name != new_name
 
+def test_api_handler_patch_if_match(models_store, lambda_context):
+    from src import api
+    api.model_store = models_store
+    model = get_mock_model(2)
+    event = api_gateway_event_v2(payload=model, path="models", method="PATCH", headers={'if-match': '"stale"'})
+    response = api.router(event, lambda_context)
+    assert response['statusCode'] == 412
+    event = api_gateway_event_v2(payload=model, path="models", method="PATCH")
+    etag = api.router(event, lambda_context)['headers']['ETag']
+    event = api_gateway_event_v2(payload=model, path="models", method="PATCH", headers={'if-match': etag})
+    response = api.router(event, lambda_context)
+    assert response['statusCode'] == 200
+    assert json.loads(response['body'])['models'][1]['version'] == 2
+
+def test_api_handler_uuid1_path(models_store, lambda_context):
+    from src import api
+    api.model_store = models_store
+    # a model may be posted with any version of uuid, so every route takes any in its path
+    guid = str(uuid.uuid1())
+    event = api_gateway_event_v2(payload={'guid': guid, 'name': "v1"}, path="models", method="POST")
+    assert api.router(event, lambda_context)['statusCode'] == 200
+    event = api_gateway_event_v2(payload={'name': "v1 patched"}, path=f"/api/models/{guid}", method="PATCH")
+    response = api.router(event, lambda_context)
+    assert response['statusCode'] == 200
+    assert json.loads(response['body'])['models'][1]['name'] == "v1 patched"
+    event = api_gateway_event_v2(payload=None, path=f"/api/models/{guid.upper()}", method="GET")
+    response = api.router(event, lambda_context)
+    assert response['statusCode'] == 200
+    assert json.loads(response['body'])['models'][0]['name'] == "v1 patched"
+    event = api_gateway_event_v2(payload=None, path=f"/api/models/{guid}", method="DELETE")
+    assert api.router(event, lambda_context)['statusCode'] == 200
+
 def test_api_handler_patch_unknown(models_store, lambda_context):
     from src import api
     api.model_store = models_store
@@ -126,6 +304,47 @@ def test_api_handler_post_known_full(models_store, lambda_context):
     assert len(body['models']) == 0
 
 
+def test_api_handler_post_batch(models_store, lambda_context):
+    from src import api
+    api.model_store = models_store
+    payload = {'operations': [
+        {'action': 'put', 'model': {'name': 'lucy'}},
+        {'action': 'put', 'model': {'name': 'edith'}},
+    ]}
+    event = api_gateway_event_v2(payload=payload, path="models/batch", method="POST")
+    response = api.router(event, lambda_context)
+    body = json.loads(response['body'])
+    assert len(body['errors']) == 0
+    assert [m['name'] for m in body['models']] == ['lucy', 'edith']
+    payload = {'operations': [{'action': 'delete', 'model': m} for m in body['models']]}
+    event = api_gateway_event_v2(payload=payload, path="models/batch", method="POST")
+    response = api.router(event, lambda_context)
+    body = json.loads(response['body'])
+    assert len(body['errors']) == 0
+    assert len(body['models']) == 2
+
+def test_api_handler_post_batch_invalid(models_store, lambda_context):
+    from src import api
+    api.model_store = models_store
+    payload = {'operations': [{'action': 'upsert', 'model': {'name': 'lucy'}}]}
+    event = api_gateway_event_v2(payload=payload, path="models/batch", method="POST")
+    response = api.router(event, lambda_context)
+    assert response['statusCode'] == 400
+    body = json.loads(response['body'])
+    assert len(body['errors']) == 1
+    # a malformed guid fails its own operation rather than naming a new model
+    payload = {'operations': [
+        {'action': 'delete', 'model': {'guid': 'typo'}},
+        {'action': 'put', 'model': {'name': 'lucy'}},
+    ]}
+    event = api_gateway_event_v2(payload=payload, path="models/batch", method="POST")
+    response = api.router(event, lambda_context)
+    assert response['statusCode'] == 400
+    body = json.loads(response['body'])
+    assert [(e['status'], e['instance']) for e in body['errors']] == [(400, 'typo')]
+    assert [m['name'] for m in body['models']] == ['lucy']
+    models_store.delete_by_guid(body['models'][0]['guid'])
+
 def test_api_handler_delete_known(models_store, lambda_context):
     from src import api
     api.model_store = models_store
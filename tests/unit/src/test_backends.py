@@ -0,0 +1,89 @@
+import pytest
+import uuid
+from src import backends, models
+from src.models import *
+from . import *
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def local_store(request, tmp_path, monkeypatch):
+    monkeypatch.setattr(models, 'sqlite_path', str(tmp_path / "models.sqlite3"))
+    store = ModelStore(f"models-{uuid.uuid4().hex}", name_index='name-index', backend=request.param)
+    for item in get_model_set():
+        store.table.put_item(Item=item)
+    yield store
+
+def test_local_store_get_and_page(local_store):
+    response: Response = local_store.get_by_guid(get_known_id(1))
+    assert response.body.models[0].name == get_known_name(1)
+    response = local_store.get_by_guid('00000000-0000-4000-8000-000000000000')
+    assert response.statusCode == 400
+    guids = []
+    query = {'limit': '2'}
+    while True:
+        response = local_store.get_all(query)
+        guids.extend(m.guid for m in response.body.models)
+        if response.body.next is None:
+            break
+        query = {'limit': '2', 'next': response.body.next}
+    assert sorted(guids) == sorted(get_known_id(i) for i in range(3))
+
+def test_local_store_filters(local_store):
+    response: Response = local_store.get_all({'metadata.foo': get_known_metadata(1)['foo'], 'fields': 'name'})
+    assert [m.name for m in response.body.models] == [get_known_name(1)]
+    response = local_store.find_by_name(get_known_name(2))
+    assert [m.guid for m in response.body.models] == [get_known_id(2)]
+    response = local_store.get_all({'name_prefix': get_known_name(0)[:3]})
+    assert get_known_id(0) in [m.guid for m in response.body.models]
+
+def test_local_store_writes(local_store):
+    model = Model(name="local")
+    assert local_store.post(model, None).statusCode == 200
+    assert local_store.post(Model(guid=model.guid), None).statusCode == 400
+    response: Response = local_store.patch(Model(guid=model.guid, metadata={'a': 1}), None)
+    assert response.statusCode == 200
+    response = local_store.patch(Model(guid=model.guid, metadata={'b': 2}, version=2), None)
+    assert [m.version for m in response.body.models] == [2, 3]
+    assert local_store.patch(Model(guid=model.guid, name="stale", version=2), None).statusCode == 409
+    stored = local_store.get_by_guid(model.guid).body.models[0]
+    assert (stored.name, stored.metadata, stored.version) == ("local", {'a': 1, 'b': 2}, 3)
+    assert local_store.delete_by_guid(model.guid).statusCode == 200
+    assert local_store.delete_by_guid(model.guid).statusCode == 400
+
+def test_local_store_batches(local_store):
+    models = [Model(name=f"batch-{i}") for i in range(5)]
+    response: Response = local_store.batch_write(BatchRequest(operations=[BatchOperation(model=m) for m in models]))
+    assert len(response.body.models) == 5
+    response = local_store.batch_get([m.guid for m in models], {'fields': 'name'})
+    assert [m.name for m in response.body.models] == [m.name for m in models]
+    scanned = list(local_store.scan_parallel(total_segments=3, page_size=2))
+    assert len(scanned) == len({m.guid for m in scanned})
+    assert {m.guid for m in scanned} == {m.guid for m in models} | {get_known_id(i) for i in range(3)}
+
+def test_local_store_changes(local_store):
+    changes = []
+    local_store.table.subscribe(lambda name, old, new: changes.append((name, old, new)))
+    model = Model(name="streamed")
+    local_store.post(model, None)
+    local_store.patch(Model(guid=model.guid, name="renamed"), None)
+    local_store.delete_by_guid(model.guid)
+    assert [name for name, _, _ in changes] == ['INSERT', 'MODIFY', 'REMOVE']
+    assert changes[1][1]['name'] == "streamed" and changes[1][2]['name'] == "renamed"
+    assert changes[2][2] is None
+
+def test_local_store_floats(local_store):
+    # boto3 refuses a float before a write is sent, so the local backends do too
+    with pytest.raises(TypeError):
+        local_store.table.put_item(Item={'guid': str(uuid.uuid4()), 'metadata': {'v': 1.5}})
+    with pytest.raises(TypeError):
+        local_store.table.batch_write_item(RequestItems={local_store.table.name: [{'PutRequest': {'Item': {'guid': str(uuid.uuid4()), 'v': 1.5}}}]})
+    model = Model(name="floats", metadata={'v': 1.5})
+    response: Response = local_store.batch_write(BatchRequest(operations=[BatchOperation(model=model)]))
+    assert response.statusCode == 200
+    assert local_store.get_by_guid(model.guid).body.models[0].metadata == {'v': Decimal('1.5')}
+
+def test_local_store_unknown_backend():
+    with pytest.raises(ValueError):
+        ModelStore(backend='cassandra')
+    with pytest.raises(TypeError):
+        backends.LocalBackend()
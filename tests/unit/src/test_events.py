@@ -2,6 +2,8 @@
 from src.models import *
 from aws_lambda_powertools.utilities.parser.models import DynamoDBStreamModel, DynamoDBStreamRecordModel
 from aws_lambda_powertools.utilities.parser import parse
+import json
+from botocore.exceptions import EndpointConnectionError
 from . import *
 
 def test_dump_change_event():
@@ -22,6 +24,25 @@ def test_dump_change_event():
     dump = me.dump()
     assert isinstance(dump['Detail'], str)
 
+def test_decode_attribute_value():
+    image = {
+        'guid': {'S': '60a5de7e-17ea-411e-b092-0652646f9d3a'},
+        'metadata': {'M': {
+            'count': {'N': '3'},
+            'ratio': {'N': '0.5'},
+            'ok': {'BOOL': True},
+            'none': {'NULL': True},
+            'tags': {'L': [{'S': 'a'}, {'M': {'S': {'S': 'nested'}}}]},
+            'sizes': {'NS': ['1', '2.5']},
+        }}
+    }
+    model = Model.from_dbstream_image(image)
+    assert model.guid == '60a5de7e-17ea-411e-b092-0652646f9d3a'
+    assert model.metadata == {
+        'count': 3, 'ratio': 0.5, 'ok': True, 'none': None,
+        'tags': ['a', {'S': 'nested'}], 'sizes': [1, 2.5]
+    }
+
 def test_event_from_dynamodb():
     in_evt = get_dynamodb_stream_event()
     model: DynamoDBStreamModel = parse( model=DynamoDBStreamModel, event=in_evt)
@@ -30,5 +51,84 @@ def test_event_from_dynamodb():
     assert model_change_evt.Detail.event_type =="CREATE"
     assert model_change_evt.Detail.model_id =='60a5de7e-17ea-411e-b092-0652646f9d3a'
 
-def test_dynamo_stream_handler():
-    pass
\ No newline at end of file
+class FakeEventBridge:
+    """ Stands in for the boto3 events client, failing entries by model_id
+        and raising errors by the number of the call
+    """
+    def __init__(self, fail: dict = None, raises: dict = None):
+        self.calls = []
+        self.fail = fail or {}
+        self.raises = raises or {}
+
+    def put_events(self, Entries):
+        self.calls.append(Entries)
+        if len(self.calls) in self.raises:
+            raise self.raises[len(self.calls)]
+        results = []
+        for entry in Entries:
+            model_id = json.loads(entry['Detail'])['model_id']
+            if self.fail.get(model_id, 0) > 0:
+                self.fail[model_id] -= 1
+                results.append({'ErrorCode': 'InternalFailure', 'ErrorMessage': 'try again'})
+            else:
+                results.append({'EventId': model_id})
+        return {'FailedEntryCount': sum(1 for r in results if 'ErrorCode' in r), 'Entries': results}
+
+def make_change_events(count: int, metadata_size: int = 0) -> list:
+    events = []
+    for _ in range(count):
+        model = Model(name='x', metadata={'blob': 'x' * metadata_size})
+        detail = ModelEventDetail(model_id=model.guid, event_type="CREATE", new_model=model)
+        events.append(ModelChangeEvent(Source="model.api.events", DetailType="model.change.create", Detail=detail))
+    return events
+
+def test_publisher_batches_by_count_and_size():
+    eventbridge = FakeEventBridge()
+    publisher = ModelEventPublisher(eventbridge)
+    results = publisher.publish(make_change_events(25))
+    assert results == [None] * 25
+    assert [len(c) for c in eventbridge.calls] == [10, 10, 5]
+    eventbridge = FakeEventBridge()
+    publisher = ModelEventPublisher(eventbridge)
+    results = publisher.publish(make_change_events(4, metadata_size=100 * 1024))
+    assert results == [None] * 4
+    assert [len(c) for c in eventbridge.calls] == [2, 2]
+
+def test_publisher_retries_failed_entries():
+    events = make_change_events(3)
+    flaky, broken = events[1].Detail.model_id, events[2].Detail.model_id
+    eventbridge = FakeEventBridge(fail={flaky: 1, broken: 10})
+    publisher = ModelEventPublisher(eventbridge)
+    publisher.BACKOFF_BASE = 0
+    results = publisher.publish(events)
+    assert results[0] is None and results[1] is None
+    assert results[2].instance == broken
+    assert len(eventbridge.calls[0]) == 3
+    assert len(eventbridge.calls[1]) == 2
+    assert len(eventbridge.calls) == publisher.MAX_RETRIES + 1
+
+def test_dynamo_stream_handler(lambda_context):
+    from src import events
+    eventbridge = FakeEventBridge()
+    events.publisher = ModelEventPublisher(eventbridge)
+    response = events.dynamo_stream_handler(get_dynamodb_stream_event(), lambda_context)
+    assert response == {"batchItemFailures": []}
+    assert len(eventbridge.calls) == 1
+
+def test_dynamo_stream_handler_partial_failure(lambda_context):
+    from src import events
+    records = get_dynamodb_stream_records(3)
+    failing = [records[1]['dynamodb']['Keys']['guid']['S'], records[2]['dynamodb']['Keys']['guid']['S']]
+    events.publisher = ModelEventPublisher(FakeEventBridge(fail={g: 10 for g in failing}))
+    events.publisher.BACKOFF_BASE = 0
+    response = events.dynamo_stream_handler({"Records": records}, lambda_context)
+    assert response == {"batchItemFailures": [{"itemIdentifier": "101"}]}
+
+def test_dynamo_stream_handler_connection_error(lambda_context):
+    from src import events
+    records = get_dynamodb_stream_records(12)
+    # the first batch of ten is put, the call for the second can not connect
+    error = EndpointConnectionError(endpoint_url="https://events.us-east-1.amazonaws.com/")
+    events.publisher = ModelEventPublisher(FakeEventBridge(raises={2: error}))
+    response = events.dynamo_stream_handler({"Records": records}, lambda_context)
+    assert response == {"batchItemFailures": [{"itemIdentifier": "110"}]}
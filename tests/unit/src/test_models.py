@@ -23,6 +23,57 @@ def test_model_instantate_dict():
     assert m.name == 'martha'
     assert 'foo' in m.metadata
 
+def test_model_cache_lru_ttl():
+    now = [0.0]
+    cache = ModelCache(max_size=2, ttl=10, clock=lambda: now[0])
+    a, b, c = Model(name='a'), Model(name='b'), Model(name='c')
+    cache.put(a)
+    cache.put(b)
+    assert cache.get(a.guid).name == 'a'
+    cache.put(c)
+    assert cache.get(b.guid) is None
+    assert cache.evictions == 1
+    now[0] = 11
+    assert cache.get(a.guid) is None
+    assert cache.peek(a.guid).name == 'a'
+    cache.renew(a.guid)
+    assert cache.get(a.guid).name == 'a'
+    assert cache.stats() == {'size': 2, 'hits': 2, 'misses': 2, 'evictions': 1, 'expirations': 1, 'revalidations': 1}
+
+def test_model_store_client_config(ddb_table):
+    config = client_config()
+    assert config.max_pool_connections > 1
+    assert config.connect_timeout <= config.read_timeout
+    assert config.retries['mode'] == 'standard'
+    a, b = ModelStore(), ModelStore(region='us-east-1')
+    assert a.region == aws_region
+    assert aws_session() is aws_session()
+    assert b.conn.meta.client.meta.config.max_pool_connections == config.max_pool_connections
+
+def test_model_store_get_cached(ddb_table):
+    store = ModelStore(region=aws_region, cache=ModelCache())
+    guid = get_known_id(1)
+    store.get(Model(guid=guid), None)
+    store.table = None
+    response: Response = store.get(Model(guid=guid), None)
+    assert response.statusCode == 200
+    assert response.body.models[0].name == get_known_name(1)
+    assert store.cache.hits == 1
+
+def test_model_store_get_revalidated(ddb_table):
+    store = ModelStore(region=aws_region, cache=ModelCache(ttl=0))
+    model = Model(name='abby')
+    store.post(model, None)
+    assert model.revision is not None
+    response: Response = store.get(Model(guid=model.guid), None)
+    assert response.body.models[0].revision == model.revision
+    assert store.cache.revalidations == 1
+    ModelStore(region=aws_region).patch(Model(guid=model.guid, name='abigail'), None)
+    response: Response = store.get(Model(guid=model.guid), None)
+    assert response.body.models[0].name == 'abigail'
+    assert store.cache.revalidations == 1
+    store.delete(model, None)
+
 def test_model_store_get(models_store):
     m = Model(guid=get_known_id())
     name = get_known_name()
@@ -38,6 +89,111 @@ def test_model_store_get_all(models_store):
     assert len(response.body.models) == 3
     assert response.body.models[1].name == name
 
+def test_model_store_get_all_paged(models_store):
+    response: Response = models_store.get_all({'limit': '2'})
+    assert response.statusCode == 200
+    assert len(response.body.models) == 2
+    assert response.body.next is not None
+    response: Response = models_store.get_all({'limit': '2', 'next': response.body.next})
+    assert response.statusCode == 200
+    assert len(response.body.models) == 1
+    assert response.body.models[0].name == get_known_name(2)
+
+def test_model_store_get_all_bad_cursor(models_store):
+    response: Response = models_store.get_all({'next': 'not-a-cursor'})
+    assert response.statusCode == 400
+    assert len(response.body.errors) == 1
+    response: Response = models_store.get_all({'limit': '0'})
+    assert response.statusCode == 400
+
+def test_model_store_get_all_filtered(models_store):
+    response: Response = models_store.get_all({'name': get_known_name(1)})
+    assert [m.guid for m in response.body.models] == [get_known_id(1)]
+    response: Response = models_store.get_all({'name_prefix': 'ma'})
+    assert [m.name for m in response.body.models] == [get_known_name(0)]
+    response: Response = models_store.get_all({'metadata.foo': 'buz', 'name_prefix': 'd'})
+    assert [m.guid for m in response.body.models] == [get_known_id(2)]
+    response: Response = models_store.get_all({'metadata.foo.bar': 'buz'})
+    assert response.statusCode == 400
+    numbered = [Model(name="numbered", metadata={'n': 2}), Model(name="numbered", metadata={'n': '2'})]
+    for model in numbered:
+        models_store.post(model, None)
+    response = models_store.get_all({'metadata.n': '2'})
+    assert sorted(m.guid for m in response.body.models) == sorted(m.guid for m in numbered)
+    assert models_store.get_all({'metadata.n': 'two'}).body.models == []
+    for model in numbered:
+        models_store.delete_by_guid(model.guid)
+
+def test_model_store_find_by_name(models_store):
+    response: Response = models_store.find_by_name(get_known_name(2), None)
+    assert response.statusCode == 200
+    assert [m.guid for m in response.body.models] == [get_known_id(2)]
+    assert response.body.next is None
+    response: Response = models_store.find_by_name(get_known_name(2), {'metadata.foo': 'bar'})
+    assert response.body.models == []
+    response: Response = models_store.find_by_name('nobody', None)
+    assert response.body.models == []
+
+def test_model_store_get_fields(models_store):
+    response: Response = models_store.get_by_guid(get_known_id(1), {'fields': 'metadata'})
+    assert response.statusCode == 200
+    assert response.body.models[0].name is None
+    assert response.body.models[0].metadata == get_known_metadata(1)
+    assert set(json.loads(response.dump()['body'])['models'][0]) == {'guid', 'metadata'}
+
+def test_model_store_scan_parallel():
+    # the moto used here ignores Segment, the memory backend splits the table like dynamodb
+    store = ModelStore(f"models-{uuid.uuid4().hex}", backend='memory')
+    for item in get_model_set():
+        store.table.put_item(Item=item)
+    guids = {m['guid'] for m in get_model_set()}
+    models = list(store.scan_parallel(total_segments=3, max_pending_pages=1, page_size=1))
+    assert len(models) == len({m.guid for m in models})
+    assert {m.guid for m in models} == guids
+    assert all(isinstance(m, Model) for m in models)
+
+def test_model_store_stream_all(models_store):
+    response = Response()
+    lines = list(models_store.stream_all({'limit': '2'}, response))
+    assert len(lines) == 2
+    assert response.body.next is not None
+    response = Response()
+    lines = list(models_store.stream_all({'next': models_store.encode_cursor({'guid': Model.parse_raw(lines[1]).guid})}, response))
+    assert len(lines) == 1
+    assert response.body.next is None
+    assert Model.parse_raw(lines[0]).name == get_known_name(2)
+
+def test_model_store_batch_get(models_store):
+    unknown = '00000000-0000-4000-8000-000000000000'
+    guids = [get_known_id(2), unknown, get_known_id(0), 'not-a-guid']
+    response: Response = models_store.batch_get(guids, None)
+    assert [m.guid for m in response.body.models] == [get_known_id(2), get_known_id(0)]
+    assert [e.instance for e in response.body.errors] == [unknown, 'not-a-guid']
+    response = models_store.batch_get([get_known_id(1).upper()], None)
+    assert [m.guid for m in response.body.models] == [get_known_id(1)]
+
+def test_async_model_store(models_store, monkeypatch):
+    import asyncio
+    monkeypatch.setattr(models_store, 'BATCH_GET_SIZE', 1)
+    monkeypatch.setattr(models_store, 'BATCH_WRITE_SIZE', 1)
+    store = AsyncModelStore(models_store, max_concurrency=2)
+    guids = [get_known_id(i) for i in range(3)]
+    models = [Model(name=f"async-{i}") for i in range(3)]
+    async def fan_out():
+        reads = await asyncio.gather(*[store.get_by_guid(guid) for guid in guids])
+        many = await store.batch_get(list(reversed(guids)))
+        written = await store.batch_write(BatchRequest(operations=[BatchOperation(model=m) for m in models]))
+        deleted = await asyncio.gather(*[store.delete_by_guid(m.guid) for m in models])
+        return reads, many, written, deleted
+    reads, many, written, deleted = asyncio.run(fan_out())
+    store.close()
+    assert [r.body.models[0].guid for r in reads] == guids
+    assert [m.guid for m in many.body.models] == list(reversed(guids))
+    assert [m.guid for m in written.body.models] == [m.guid for m in models]
+    assert all(d.statusCode == 200 for d in deleted)
+    with pytest.raises(ValueError):
+        AsyncModelStore(models_store, max_concurrency=0)
+
 def test_model_store_post_empty(models_store):
     model = Model()
     response: Response = models_store.post(model, None)
@@ -71,6 +227,70 @@ def test_model_store_post_exist(models_store):
     assert response.statusCode == 200
     assert len(response.body.models) == 5
 
+def test_model_store_batch_write(models_store):
+    new = Model(name='dolley payne', metadata={'foo': 'bat'})
+    batch = BatchRequest(operations=[
+        BatchOperation(action='put', model=new),
+        BatchOperation(action='delete', model=Model(guid=new.guid)),
+    ])
+    response: Response = models_store.batch_write(batch, None)
+    assert response.statusCode == 400
+    assert len(response.body.errors) == 2
+    assert response.body.errors[0].instance == new.guid
+    batch = BatchRequest(operations=[BatchOperation(action='put', model=Model(name=f"m{i}")) for i in range(30)])
+    response: Response = models_store.batch_write(batch, None)
+    assert response.statusCode == 200
+    assert len(response.body.models) == 30
+    batch = BatchRequest(operations=[BatchOperation(action='delete', model=m) for m in response.body.models])
+    response: Response = models_store.batch_write(batch, None)
+    assert response.statusCode == 200
+    assert len(response.body.models) == 30
+
+def test_model_store_batch_write_version(models_store):
+    model = Model(name="forged", version=999)
+    response: Response = models_store.batch_write(BatchRequest(operations=[BatchOperation(model=model)]), None)
+    assert response.body.models[0].version == 1
+    assert models_store.get_by_guid(model.guid).body.models[0].version == 1
+    models_store.delete_by_guid(model.guid)
+
+def test_model_store_write_floats(models_store):
+    # json numbers with a fraction decode to floats, which boto3 does not write
+    model = Model(name="floats", metadata={'v': 1.5})
+    batch = BatchRequest(operations=[
+        BatchOperation(model=model),
+        BatchOperation(model=Model(name="infinite", metadata={'v': float('inf')})),
+    ])
+    response: Response = models_store.batch_write(batch, None)
+    assert [e.title for e in response.body.errors] == ["invalid number"]
+    assert models_store.get_by_guid(model.guid).body.models[0].metadata == {'v': Decimal('1.5')}
+    assert models_store.patch(Model(guid=model.guid, metadata={'w': 0.25}), None).statusCode == 200
+    assert json.loads(models_store.get_by_guid(model.guid).dump()['body'])['models'][0]['metadata'] == {'v': 1.5, 'w': 0.25}
+    posted = Model(name="posted", metadata={'v': [0.5]})
+    assert models_store.post(posted, None).statusCode == 200
+    models_store.batch_write(BatchRequest(operations=[BatchOperation(action='delete', model=m) for m in (model, posted)]), None)
+
+def test_model_store_batch_write_unprocessed(models_store, monkeypatch):
+    client = models_store.table.meta.client
+    real_write = client.batch_write_item
+    calls = []
+    def flaky_write(RequestItems):
+        calls.append(RequestItems)
+        if len(calls) == 1:
+            requests = RequestItems[models_store.table_name]
+            real_write(RequestItems={models_store.table_name: requests[1:]})
+            return {'UnprocessedItems': {models_store.table_name: requests[:1]}}
+        return real_write(RequestItems=RequestItems)
+    monkeypatch.setattr(client, 'batch_write_item', flaky_write)
+    monkeypatch.setattr(models_store, 'BATCH_BACKOFF_BASE', 0)
+    models = [Model(name="retry-a"), Model(name="retry-b")]
+    batch = BatchRequest(operations=[BatchOperation(action='put', model=m) for m in models])
+    response: Response = models_store.batch_write(batch, None)
+    assert response.statusCode == 200
+    assert len(calls) == 2
+    assert [m.guid for m in response.body.models] == [m.guid for m in models]
+    batch = BatchRequest(operations=[BatchOperation(action='delete', model=m) for m in models])
+    models_store.batch_write(batch, None)
+
 def test_model_store_patch_known(models_store):
     data = get_mock_model(1)
     model = Model(**data)
@@ -82,6 +302,81 @@ def test_model_store_patch_known(models_store):
     assert response.body.models[0].guid == response.body.models[1].guid 
     assert response.body.models[0].name != response.body.models[1].name    
 
+def test_model_store_patch_version(models_store):
+    model = Model(name="versioned")
+    models_store.post(model, None)
+    assert model.version == 1
+    first = Model(guid=model.guid, name="first", version=1)
+    response: Response = models_store.patch(first, None)
+    assert response.statusCode == 200
+    assert [m.version for m in response.body.models] == [1, 2]
+    # a second writer that read version 1 loses and nothing is written
+    second = Model(guid=model.guid, name="second", version=1)
+    response = models_store.patch(second, None)
+    assert response.statusCode == 409
+    assert response.body.errors[0].title == "version conflict"
+    assert models_store.get_by_guid(model.guid).body.models[0].name == "first"
+    response = models_store.patch(Model(guid=model.guid, name="third"), None, {model.revision})
+    assert response.statusCode == 412
+    response = models_store.patch(Model(guid=model.guid, name="third"), None, {first.revision})
+    assert response.statusCode == 200
+    assert response.body.models[1].version == 3
+    models_store.delete_by_guid(model.guid)
+
+def test_model_store_patch_partial(ddb_table):
+    store = ModelStore(region=aws_region, cache=ModelCache())
+    model = Model(name="partial")
+    store.post(model, None)
+    # the first metadata key of a model without metadata writes the whole map
+    response: Response = store.patch(Model(guid=model.guid, metadata={'a': 1, 'b': 2}), None)
+    assert response.statusCode == 200
+    assert store.get_by_guid(model.guid).body.models[0].metadata == {'a': 1, 'b': 2}
+    response = store.patch(Model(guid=model.guid, metadata={'b': None, 'c': 3}), None)
+    assert response.statusCode == 200
+    assert response.body.models[1].metadata == {'c': 3}
+    assert 'name' not in json.loads(response.dump()['body'])['models'][1]
+    # the cached copy was patched rather than dropped
+    assert store.cache.peek(model.guid).metadata == {'a': 1, 'c': 3}
+    stored = ModelStore(region=aws_region).get_by_guid(model.guid).body.models[0]
+    assert stored.name == "partial"
+    assert stored.metadata == {'a': 1, 'c': 3}
+    assert stored.version == 3
+    store.patch(Model.parse_obj({'guid': model.guid, 'name': None}), None)
+    assert ModelStore(region=aws_region).get_by_guid(model.guid).body.models[0].name is None
+    store.delete_by_guid(model.guid)
+
+def test_model_store_patch_metadata_race(models_store):
+    model = Model(name="racing")
+    models_store.post(model, None)
+    update = models_store._update
+    def racing_update(guid, changes, metadata, condition, nested):
+        if not nested:
+            # another writer makes the map between the nested write and the whole one
+            update(guid, {}, {'a': 1}, Attr("guid").eq(guid), nested=False)
+        return update(guid, changes, metadata, condition, nested)
+    models_store._update = racing_update
+    try:
+        response: Response = models_store.patch(Model(guid=model.guid, metadata={'b': 2}), None)
+    finally:
+        del models_store._update
+    assert response.statusCode == 200
+    assert models_store.get_by_guid(model.guid).body.models[0].metadata == {'a': 1, 'b': 2}
+    models_store.delete_by_guid(model.guid)
+
+def test_model_store_empty_name(models_store):
+    # moto does not enforce it, dynamodb rejects an empty string as an index key
+    model = Model(name="")
+    assert models_store.post(model, None).statusCode == 400
+    model = Model(name="named")
+    models_store.post(model, None)
+    response: Response = models_store.patch(Model(guid=model.guid, name=""), None)
+    assert response.statusCode == 400
+    assert response.body.errors[0].title == "invalid name"
+    batch = BatchRequest(operations=[BatchOperation(model=Model(name="")), BatchOperation(action='delete', model=Model(guid=model.guid))])
+    response = models_store.batch_write(batch, None)
+    assert [e.title for e in response.body.errors] == ["invalid name"]
+    assert [m.guid for m in response.body.models] == [model.guid]
+
 def test_model_store_patch_unknown(models_store):
     model = Model(
         guid= '00000000-0000-0000-0000-000000000000',